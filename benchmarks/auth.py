@@ -0,0 +1,88 @@
+"""
+Authentication overhead per request: reading the auth context of the bearer token and resolving its user.
+
+Every request runs Auth.read_context and Auth.get_current_user with a new session, as the middleware and the
+dependencies of a protected route do, in three ways:
+
+``cold``       nothing cached: the token is verified with jwt.decode and the user is queried
+``token``      the claims come from Auth.token_cache, the user is still queried
+``user``       the claims come from Auth.token_cache and the user from user_cache, no query
+
+The user is queried from the database given by --db-url, an in-memory SQLite database by default, so the
+query is cheaper than over the network to Postgres. The settings of the application are read from
+the environment or .env as usual.
+
+    python -m benchmarks.auth --requests 2000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.models.models import Base, User
+from src.services.auth import auth_service
+from src.services.user_cache import user_cache
+
+EMAIL = 'benchmark@example.com'
+MODES = ('cold', 'token', 'user')
+
+
+async def measure(session_maker, authorization: str, mode: str, requests: int) -> float:
+    """
+    The measure function authenticates requests one after the other, emptying the caches the mode does not use
+    before each of them.
+
+    :param session_maker: Session factory of the benchmark database
+    :param authorization: str: The Authorization header of the requests
+    :param mode: str: 'cold', 'token' or 'user'
+    :param requests: int: Number of requests
+    :return: The mean time per request in seconds
+    :doc-author: RSA
+    """
+    elapsed = 0.0
+    for _ in range(requests):
+        if mode == 'cold':
+            auth_service.token_cache.clear()
+        if mode != 'user':
+            user_cache.entries.clear()
+        started = time.perf_counter()
+        async with session_maker() as db:
+            context = auth_service.read_context(authorization)
+            await auth_service.get_current_user(context, db)
+        elapsed += time.perf_counter() - started
+    return elapsed / requests
+
+
+async def run(db_url: str, requests: int):
+    engine = create_async_engine(db_url)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_maker() as db:
+        db.add(User(email=EMAIL, password='benchmark', first_name='Benchmark', last_name='User',
+                    confirmed=True, is_active=True))
+        await db.commit()
+    token = await auth_service.create_access_token(data={'sub': EMAIL}, expires_delta=3600)
+    authorization = f'Bearer {token}'
+
+    print(f'{requests} requests per mode')
+    print(f'{"mode":<8}{"us/request":>12}{"requests/s":>12}')
+    for mode in MODES:
+        # one request first, so the caches a mode keeps are filled
+        await measure(session_maker, authorization, mode, 1)
+        per_request = await measure(session_maker, authorization, mode, requests)
+        print(f'{mode:<8}{per_request * 1e6:>12.1f}{1 / per_request:>12.0f}')
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', default='sqlite+aiosqlite://', help='SQLAlchemy URL of a scratch database')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.db_url, args.requests))
+
+
+if __name__ == '__main__':
+    main()
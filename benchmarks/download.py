@@ -0,0 +1,157 @@
+"""
+Throughput and peak memory of GET /api/images/download/{image_id}, the streaming path against the old one.
+
+``buffered`` is the download path before streaming: a blocking requests.get of the whole object,
+decoded by PIL and encoded again as PNG to a file, which is then sent. ``stream`` is the current path:
+StorageBackend.open_stream over the pooled httpx client, passing the chunks through.
+Both read the same JPEG from a local HTTP origin started by the script, and each mode runs in a fresh
+process so its peak RSS is its own.
+
+Run it from the root of the repository with the settings of the application in the environment or .env:
+
+    python -m benchmarks.download --size 2000 --requests 20 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from io import BytesIO
+
+NAME = 'benchmark.jpg'
+MODES = ('buffered', 'stream')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_image(directory: str, size: int) -> int:
+    """
+    The make_image function writes a noisy JPEG of size x size pixels, which compresses about as badly as a photo.
+
+    :param directory: str: Directory served by the origin
+    :param size: int: Width and height of the image
+    :return: The size of the file in bytes
+    :doc-author: RSA
+    """
+    from PIL import Image
+
+    path = os.path.join(directory, NAME)
+    Image.effect_noise((size, size), 64).convert('RGB').save(path, 'JPEG', quality=90)
+    return os.path.getsize(path)
+
+
+def start_origin(directory: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def download_buffered(url: str, workdir: str) -> int:
+    import requests
+    from PIL import Image
+
+    response = requests.get(url)
+    image = Image.open(BytesIO(response.content))
+    path = os.path.join(workdir, 'image.png')
+    image.save(path)
+    sent = 0
+    with open(path, 'rb') as file:
+        while chunk := file.read(64 * 1024):
+            sent += len(chunk)
+    return sent
+
+
+async def download_stream(storage, name: str) -> int:
+    stream = await storage.open_stream(name)
+    sent = 0
+    async for chunk in stream.body():
+        sent += len(chunk)
+    return sent
+
+
+async def run_mode(mode: str, origin: str, requests: int, concurrency: int) -> dict:
+    """
+    The run_mode function downloads the image requests times, concurrency at a time, as the route would.
+
+    :param mode: str: 'buffered' or 'stream'
+    :param origin: str: Base URL of the origin
+    :param requests: int: Number of downloads
+    :param concurrency: int: Number of concurrent downloads
+    :return: The measurements of the run
+    :doc-author: RSA
+    """
+    from src.services.http import http_client
+    from src.services.storage import CloudinaryStorage
+
+    class OriginStorage(CloudinaryStorage):
+        def url(self, name: str, **transformation) -> str:
+            return f'{origin}/{name}'
+
+    storage = OriginStorage()
+    workdir = tempfile.TemporaryDirectory()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> int:
+        async with semaphore:
+            if mode == 'buffered':
+                return await download_buffered(f'{origin}/{NAME}', workdir.name)
+            return await download_stream(storage, NAME)
+
+    started = time.perf_counter()
+    sent = sum(await asyncio.gather(*(one() for _ in range(requests))))
+    elapsed = time.perf_counter() - started
+    await http_client.close()
+    workdir.cleanup()
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed,
+        'mb_per_second': sent / elapsed / 2 ** 20,
+        'bytes_per_response': sent // requests,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help='width and height of the image in pixels')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=MODES, help='run a single mode against --origin, used internally')
+    parser.add_argument('--origin')
+    args = parser.parse_args()
+
+    if args.mode:
+        result = asyncio.run(run_mode(args.mode, args.origin, args.requests, args.concurrency))
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_size = make_image(directory, args.size)
+        server = start_origin(directory)
+        origin = f'http://127.0.0.1:{server.server_address[1]}'
+        print(f'{NAME}: {file_size / 2 ** 20:.1f} MB, {args.requests} requests, concurrency {args.concurrency}')
+        print(f'{"mode":<10}{"req/s":>10}{"MB/s":>10}{"MB/resp":>10}{"peak RSS MB":>14}')
+        for mode in MODES:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.download', '--mode', mode, '--origin', origin,
+                                     '--requests', str(args.requests), '--concurrency', str(args.concurrency)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f'{mode:<10}{result["requests_per_second"]:>10.1f}{result["mb_per_second"]:>10.1f}'
+                  f'{result["bytes_per_response"] / 2 ** 20:>10.1f}{result["peak_rss_mb"]:>14.0f}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
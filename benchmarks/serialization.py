@@ -0,0 +1,96 @@
+"""
+Responses per second of the image list endpoints, serialized through the response model against straight from the rows.
+
+``schema`` is what FastAPI did for ``response_model=List[ImageReadSchema]``: the rows are validated into the
+schemas, converted by jsonable_encoder and rendered by JSONResponse. ``rows`` is the current path:
+src.utils.serializers.image_row and dump_json. Both serialize the same images, each with its owner, three tags
+and the variants of its blob, and the script checks that they produce the same document.
+
+Run it from the root of the repository:
+
+    python -m benchmarks.serialization --items 10 100 500
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+
+from src.models.models import Image, ImageBlob, Tag, User
+from src.schemas.image import ImageReadSchema
+from src.utils.serializers import image_row, dump_json
+
+images_adapter = TypeAdapter(List[ImageReadSchema])
+
+
+def make_images(count: int) -> list[Image]:
+    """
+    The make_images function builds count images as the list queries load them, without a database.
+
+    :param count: int: Number of images
+    :return: A list of images with their owner, tags and blob
+    :doc-author: RSA
+    """
+    owner = User(id=uuid.uuid4(), first_name='Benchmark', last_name='User', email='benchmark@example.com')
+    start = datetime(2024, 1, 1)
+    images = []
+    for number in range(count):
+        blob = ImageBlob(variants={f'{width}_{fmt}': f'https://example.com/{number}_{width}.{fmt}'
+                                   for width, fmt in ((160, 'webp'), (400, 'webp'), (400, 'jpeg'))})
+        images.append(Image(id=number + 1, path=f'https://example.com/{number}.jpg', size=250_000,
+                            title=f'image {number}', created_at=start + timedelta(seconds=number), count_tags=3,
+                            tags=[Tag(name=f'tag-{number % 7}-{index}') for index in range(3)], owner=owner,
+                            blob=blob, width=1920, height=1080, format='JPEG', orientation=1, taken_at=start))
+    return images
+
+
+def render_schema(images: list[Image]) -> bytes:
+    content = jsonable_encoder(images_adapter.validate_python(images, from_attributes=True))
+    return JSONResponse(content).body
+
+
+def render_rows(images: list[Image]) -> bytes:
+    return Response(dump_json([image_row(image) for image in images]), media_type='application/json').body
+
+
+def measure(render, images: list[Image], seconds: float) -> float:
+    """
+    The measure function renders the images repeatedly for about the given time.
+
+    :param render: The function rendering a response of the images
+    :param images: list[Image]: The images of the response
+    :param seconds: float: How long to run
+    :return: The responses rendered per second
+    :doc-author: RSA
+    """
+    rendered = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < seconds:
+        render(images)
+        rendered += 1
+    return rendered / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 500], help='images per response')
+    parser.add_argument('--seconds', type=float, default=2.0, help='time spent on each measurement')
+    args = parser.parse_args()
+
+    print(f'{"items":>6}{"schema resp/s":>16}{"rows resp/s":>14}{"speedup":>10}')
+    for count in args.items:
+        images = make_images(count)
+        if json.loads(render_schema(images)) != json.loads(render_rows(images)):
+            raise SystemExit('The two paths render different documents')
+        schema = measure(render_schema, images, args.seconds)
+        rows = measure(render_rows, images, args.seconds)
+        print(f'{count:>6}{schema:>16.0f}{rows:>14.0f}{rows / schema:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
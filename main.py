@@ -10,14 +10,34 @@ from starlette import status
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 
-from src.database.db import get_db
+from src.conf.config import settings
+from src.database.db import get_db, redis_client
 from src.routes import auth, users, images, transform, admin, comments
-from src.routes.auth import blacklisted_tokens
-from src.utils.utils import periodic_clean_blacklist
+from src.utils.pagination import NEXT_CURSOR_HEADER
+from src.services.executor import storage_executor, image_executor, password_executor
+from src.services.http import http_client
+from src.services.duplicates import duplicate_index
+from src.services.auth import auth_service
+from src.services.blacklist import token_blacklist
+from src.services.user_cache import user_cache
+from src.services.storage import storage_service
+from src.services.upload import BodySizeLimitMiddleware, upload_body_limit
+from worker import start_workers
 
 app = FastAPI(swagger_ui_parameters={"operationsSorter": "method"}, title="PhotoShare")
 
 origins = ['*']
+job_workers: list[asyncio.Task] = []
+
+# Added first, so it is the innermost middleware: the 413 it raises while the body is received
+# reaches the route handler as is, not wrapped by the function middlewares below
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        ('POST', '/api/images/'): upload_body_limit(1),
+        ('POST', '/api/images/batch'): upload_body_limit(settings.batch_max_files),
+    },
+)
 
 
 @app.middleware("http")
@@ -26,22 +46,24 @@ async def block_blacklisted_tokens(request: Request, call_next: Callable):
     The block_blacklisted_tokens function is a middleware function that checks if the access token in the Authorization
     header of an incoming request is blacklisted. If it is, then this function returns a 401 Unauthorized response.
     Otherwise, it passes control to the next handler.
+    Tokens that were not revoked are let through by the Bloom filter of the blacklist without a Redis round trip.
+    The header is parsed and the token decoded here once; the resulting auth context is stored on
+    ``request.state.auth`` and reused by the security dependencies of the routes.
 
     :param request: Request: Access the request object
     :param call_next: Callable: Pass the request to the next middleware in line
     :return: The result of calling the next handler in the chain
     :doc-author: RSA
     """
-    authorization_header = request.headers.get("Authorization")
-    if authorization_header is None:
+    context = auth_service.read_context(request.headers.get("Authorization"))
+    if context is None:
+        return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"detail": "Token is invalid"})
+    request.state.auth = context
+    if context.token is None:
         # Якщо відсутній заголовок "Authorization", пропустити до наступного обробника
         response = await call_next(request)
         return response
-    parts = authorization_header.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"detail": "Token is invalid"})
-    access_token = parts[1]
-    if access_token in blacklisted_tokens:
+    if await token_blacklist.is_revoked(context.token):
         return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"detail": "Token is blacklisted"})
 
     response = await call_next(request)
@@ -54,12 +76,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, 'ETag'],
 )
 
 
 @app.on_event("startup")
 async def startup():
-    asyncio.create_task(periodic_clean_blacklist(60))
+    storage_service.open()
+    asyncio.create_task(token_blacklist.run())
+    if settings.user_cache_pubsub:
+        asyncio.create_task(user_cache.listen())
+    job_workers.extend(start_workers(settings.job_inline_workers))
+    asyncio.create_task(duplicate_index.rebuild())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in job_workers:
+        task.cancel()
+    storage_executor.shutdown()
+    image_executor.shutdown()
+    password_executor.shutdown()
+    storage_service.close()
+    await http_client.close()
+    await redis_client.aclose()
 
 
 app.include_router(auth.router, prefix="/api")
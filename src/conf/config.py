@@ -29,6 +29,56 @@ class Settings(BaseSettings):
     cloudinary_api_secret: str
     cloudinary_url: str
     max_image_size: int
+    upload_chunk_size: int = 64 * 1024
+    batch_max_files: int = 50
+    batch_upload_parallelism: int = 4
+    storage_max_workers: int = 8
+    storage_max_queue: int = 32
+    storage_backend: str = 'cloudinary'
+    storage_local_root: str = 'media'
+    storage_local_url: str = '/api/images/media'
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_timeout: float = 30.0
+    http_connect_timeout: float = 5.0
+    cloudinary_pool_size: int = 8
+    cloudinary_timeout: float = 60.0
+    cloudinary_connect_timeout: float = 5.0
+    download_cache_dir: str = 'cache/downloads'
+    download_cache_max_bytes: int = 512 * 1024 * 1024
+    password_workers: int = 2
+    password_max_queue: int = 16
+    bcrypt_rounds: int = 12
+    image_workers: int = 2
+    image_max_queue: int = 64
+    image_variant_widths: list[int] = [160, 480, 1080]
+    image_variant_formats: list[str] = ['webp', 'jpeg']
+    image_variant_quality: int = 80
+    qr_code_cache_size: int = 1024
+    job_queue_backend: str = 'redis'
+    job_queue_sqlite_path: str = 'cache/jobs.sqlite3'
+    job_inline_workers: int = 0
+    job_max_attempts: int = 3
+    job_retry_delay: float = 2.0
+    job_poll_interval: float = 0.5
+    job_lease_timeout: int = 10 * 60
+    job_result_ttl: int = 24 * 60 * 60
+    response_cache_backend: str = 'redis'
+    response_cache_image_ttl: int = 300
+    response_cache_page_ttl: int = 60
+    blacklist_backend: str = 'redis'
+    blacklist_bloom_capacity: int = 100000
+    blacklist_bloom_error_rate: float = 0.001
+    blacklist_rebuild_interval: int = 60 * 60
+    blacklist_retry_delay: float = 5.0
+    blacklist_default_ttl: int = 24 * 60 * 60
+    jwt_cache_size: int = 10000
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 60.0
+    user_cache_pubsub: bool = True
+    user_cache_retry_delay: float = 5.0
+    session_backend: str = 'redis'
+    session_ttl: int = 30 * 24 * 60 * 60
     max_add_tags: int
 
     model_config = ConfigDict(extra='ignore', env_file=".env", env_file_encoding="utf-8")
@@ -32,5 +32,7 @@ async def get_db():
 
 
 sessionmanager = DatabaseSessionManager(settings.db_url)
+redis_client = redis.Redis(host=settings.redis_host, port=settings.redis_port,
+                           password=settings.redis_password or None, decode_responses=True)
 
 
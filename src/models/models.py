@@ -2,7 +2,8 @@ import enum
 import uuid
 from datetime import datetime
 
-from sqlalchemy import String, Integer, ForeignKey, DateTime, func, Column, Boolean, Enum, CheckConstraint, UUID, Text
+from sqlalchemy import String, Integer, ForeignKey, DateTime, func, Column, Boolean, Enum, CheckConstraint, UUID, Text, \
+    JSON, SmallInteger, BigInteger, Index
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column
 
@@ -26,7 +27,6 @@ class User(Base):
     password = Column(String(length=1024), nullable=False)
     role = Column(Enum(Role), default=Role.user, nullable=False)
     avatar = Column(String(255), nullable=True)
-    refresh_token = Column(String(255), nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     confirmed = Column(Boolean, default=False, nullable=False)
@@ -41,6 +41,9 @@ class User(Base):
 
 class ImageToTag(Base):
     __tablename__ = "image_to_tag"
+    __table_args__ = (
+        Index('ix_image_to_tag_tag_id_image_id', 'tag_id', 'image_id'),
+    )
     id = Column(Integer, primary_key=True)
     image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE", onupdate="CASCADE"))
     tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE", onupdate="CASCADE"))
@@ -48,17 +51,49 @@ class ImageToTag(Base):
 
 class Image(Base):
     __tablename__ = 'images'
+    __table_args__ = (
+        Index('ix_images_created_at_id', 'created_at', 'id'),
+        Index('ix_images_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     size = Column(Integer, nullable=False, index=True)
     path = Column(String(length=255),  index=True)
     created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     count_tags = Column(Integer, default=0, nullable=False)
-    owner = relationship("User", back_populates="images", lazy="joined")
-    tags = relationship("Tag", secondary="image_to_tag", back_populates="images", lazy="joined")
+    digest = Column(String(64), ForeignKey("image_blobs.digest"), index=True, nullable=True)
+    width = Column(Integer, index=True, nullable=True)
+    height = Column(Integer, index=True, nullable=True)
+    format = Column(String(16), index=True, nullable=True)
+    orientation = Column(SmallInteger, index=True, nullable=True)
+    taken_at = Column(DateTime, index=True, nullable=True)
+    phash = Column(BigInteger, index=True, nullable=True)
+    owner = relationship("User", back_populates="images")
+    tags = relationship("Tag", secondary="image_to_tag", back_populates="images")
     comments = relationship("Comment", back_populates="image")
+    blob = relationship("ImageBlob")
+
+    @property
+    def variants(self) -> dict[str, str]:
+        if self.blob is None or self.blob.variants is None:
+            return {}
+        return self.blob.variants
+
+
+class ImageBlob(Base):
+    __tablename__ = 'image_blobs'
+
+    id = Column(Integer, primary_key=True, index=True)
+    digest = Column(String(64), unique=True, index=True, nullable=False)
+    name = Column(String(255), nullable=False)
+    path = Column(String(length=255), nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)
+    variants = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=func.now())
 
 
 class Tag(Base):
@@ -66,11 +101,14 @@ class Tag(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
-    images = relationship("Image", secondary="image_to_tag", back_populates="tags", lazy="joined")
+    images = relationship("Image", secondary="image_to_tag", back_populates="tags")
 
 
 class Comment(Base):
     __tablename__ = 'comments'
+    __table_args__ = (
+        Index('ix_comments_image_id_created_at_id', 'image_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     text = Column(Text)
@@ -2,6 +2,8 @@ from sqlalchemy import select
 from src.models.models import User, Role, Comment
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.services.user_cache import user_cache
+
 
 async def change_user_status(user: User, is_active: bool, db: AsyncSession):
 
@@ -16,6 +18,7 @@ async def change_user_status(user: User, is_active: bool, db: AsyncSession):
     """
     user.is_active = is_active
     await db.commit()
+    await user_cache.invalidate(user.email)
     await db.refresh(user)
 
 
@@ -31,6 +34,7 @@ async def update_user_role(user: User, role: Role, db: AsyncSession):
     """
     user.role = role
     await db.commit()
+    await user_cache.invalidate(user.email)
     await db.refresh(user)
 
 
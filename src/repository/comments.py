@@ -1,8 +1,11 @@
 
+from datetime import datetime
+
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.models.models import User, Comment, Image
+from src.utils.pagination import paginate
 
 
 async def create_comment(image_id: int,
@@ -39,20 +42,22 @@ async def create_comment(image_id: int,
         return None
 
 
-async def get_comments(image_id: int, limit: int, offset: int, db: AsyncSession):
+async def get_comments(image_id: int, limit: int, offset: int, db: AsyncSession,
+                       after: tuple[datetime, int] | None = None):
     """
     The get_comments function returns a list of comments for the image with the given id.
-    The limit and offset parameters are used to paginate through results.
+    The limit and offset parameters are used to paginate through results, oldest comments first.
 
 
     :param image_id: int: Filter the comments by image_id
     :param limit: int: Limit the number of comments returned
     :param offset: int: Get the comments after a certain number of comments
     :param db: AsyncSession: Pass the database session to the function
+    :param after: tuple[datetime, int] | None: Key of the last comment of the previous page, used instead of offset
     :return: A list of comments for the given image
     :doc-author: RSA
     """
-    stmt = select(Comment).filter_by(image_id=image_id).offset(offset).limit(limit)
+    stmt = paginate(select(Comment).filter_by(image_id=image_id), Comment, limit, offset, after, descending=False)
     comments = await db.execute(stmt)
     return comments.scalars().all()
 
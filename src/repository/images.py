@@ -1,14 +1,31 @@
 
+from collections import Counter
+from datetime import datetime
 from uuid import uuid4
 
-from fastapi import UploadFile, HTTPException
-from sqlalchemy import select
+from fastapi import HTTPException
+from sqlalchemy import select, update, delete, func, distinct
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from starlette import status
 
-from src.models.models import Image, Tag, User
+from src.models.models import Image, ImageBlob, ImageToTag, Tag, User
 from src.conf.config import settings
 from src.schemas.image import ImageCreateSchema
+from src.services.cache import response_cache
+from src.services.duplicates import duplicate_index
+from src.utils.pagination import paginate
+
+# Columns read from the content of an upload at ingest, see src.services.ingest.read_upload_metadata
+IMAGE_METADATA = ('width', 'height', 'format', 'orientation', 'taken_at', 'phash')
+# The relationships of Image are lazy, every query states what it loads. The many-to-one owner and blob
+# are joined, the tags are loaded by one extra SELECT ... IN query, so the rows are never multiplied by the tags
+IMAGE_LOAD = (joinedload(Image.owner), selectinload(Image.tags), joinedload(Image.blob))
+# List views only load the columns of the owner and blob shown by ImageReadSchema
+IMAGE_LIST_LOAD = (joinedload(Image.owner).load_only(User.id, User.first_name, User.last_name, User.email),
+                   selectinload(Image.tags),
+                   joinedload(Image.blob).load_only(ImageBlob.variants))
 
 
 async def get_image(image_id: int, db: AsyncSession):
@@ -21,24 +38,40 @@ async def get_image(image_id: int, db: AsyncSession):
     :return: An image object
     :doc-author: RSA
     """
-    query = select(Image).filter_by(id=image_id)
+    query = select(Image).options(*IMAGE_LOAD).filter_by(id=image_id)
     result = await db.execute(query)
-    return result.unique().scalar_one_or_none()
+    return result.scalar_one_or_none()
 
 
-async def get_images(limit: int, offset: int, db: AsyncSession):
+async def reload_image(image_id: int, db: AsyncSession):
     """
-    The get_images function returns a list of images from the database.
+    The reload_image function loads an image again after a commit, together with its owner, tags and blob,
+    replacing the state of the instance already in the session.
+
+    :param image_id: int: Id of the image to load
+    :param db: AsyncSession: Pass the database session to the function
+    :return: An image object
+    :doc-author: RSA
+    """
+    query = select(Image).options(*IMAGE_LOAD).filter_by(id=image_id).execution_options(populate_existing=True)
+    result = await db.execute(query)
+    return result.scalar_one()
+
+
+async def get_images(limit: int, offset: int, db: AsyncSession, after: tuple[datetime, int] | None = None):
+    """
+    The get_images function returns a list of images from the database, newest first.
 
     :param limit: int: Limit the number of images returned
     :param offset: int: Get the next set of images
     :param db: AsyncSession: Pass the database session to the function
+    :param after: tuple[datetime, int] | None: Key of the last image of the previous page, used instead of offset
     :return: A list of image objects
     :doc-author: RSA
     """
-    query = select(Image).offset(offset).limit(limit)
+    query = paginate(select(Image).options(*IMAGE_LIST_LOAD), Image, limit, offset, after)
     images = await db.execute(query)
-    return images.unique().scalars().all()
+    return images.scalars().all()
 
 
 async def get_user_image(image_id: int, user: User, db: AsyncSession):
@@ -53,25 +86,27 @@ async def get_user_image(image_id: int, user: User, db: AsyncSession):
     :return: The image that matches the given id and user
     :doc-author: RSA
     """
-    query = select(Image).filter_by(id=image_id).filter_by(user_id=user.id)
+    query = select(Image).options(*IMAGE_LOAD).filter_by(id=image_id).filter_by(user_id=user.id)
     images = await db.execute(query)
-    return images.unique().scalar_one_or_none()
+    return images.scalar_one_or_none()
 
 
-async def get_user_images(limit: int, offset: int, user: User, db: AsyncSession):
+async def get_user_images(limit: int, offset: int, user: User, db: AsyncSession,
+                          after: tuple[datetime, int] | None = None):
     """
-    The get_user_images function returns a list of images for the given user.
+    The get_user_images function returns a list of images for the given user, newest first.
 
     :param limit: int: Limit the number of images returned
     :param offset: int: Determine the offset of images to return
     :param user: User: Get the user_id of the user
     :param db: AsyncSession: Pass the database session to the function
+    :param after: tuple[datetime, int] | None: Key of the last image of the previous page, used instead of offset
     :return: A list of images
     :doc-author: RSA
     """
-    query = select(Image).filter_by(user_id=user.id).offset(offset).limit(limit)
+    query = paginate(select(Image).options(*IMAGE_LIST_LOAD).filter_by(user_id=user.id), Image, limit, offset, after)
     images = await db.execute(query)
-    return images.unique().scalars().all()
+    return images.scalars().all()
 
 
 async def get_tag(tag_name: str, db: AsyncSession):
@@ -87,73 +122,158 @@ async def get_tag(tag_name: str, db: AsyncSession):
     """
     query = select(Tag).filter_by(name=tag_name)
     result = await db.execute(query)
-    return result.unique().scalar_one_or_none()
+    return result.scalar_one_or_none()
+
+
+# Update File in DB
+async def update_image_title(image: Image, title: str, db: AsyncSession):
+    """
+    The update_image_title function updates the title of an image.
+
+    :param image: Image: Pass the image object to the function
+    :param title: str: Pass in the new title for the image
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The updated image object
+    :doc-author: RSA
+    """
+    image.title = title
+    await db.commit()
+    await response_cache.invalidate(image.id)
+    return await reload_image(image.id, db)
 
 
-# Get file size
-async def get_file_size(file):
+# Delete image from DB
+async def delete_image_from_db(image: Image, db: AsyncSession):
     """
-    The get_file_size function takes a file object as an argument and returns the size of that file in bytes.
-    The function first reads the entire contents of the file into memory, then uses Python's built-in len() function to get
-    the length (i.e., number of characters) in that string, which is equivalent to getting the size of a binary file.
+    The delete_image_from_db function deletes an image from the database.
+    If the image points to a stored blob, the reference count of the blob is decremented in the same transaction
+    and the blob row is removed together with its last reference.
 
-    :param file: Pass in the file object
-    :return: The size of the file in bytes
+    :param image: Image: Pass the image object to be deleted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The paths of the stored files (original and variants) that are no longer referenced by any image
     :doc-author: RSA
     """
-    file_content = await file.read()
-    file_size = len(file_content)
-    await file.seek(0)
-    return file_size
+    orphan_paths = [image.path]
+    await db.delete(image)
+    await db.flush()
+    if image.digest:
+        orphan_paths = await _release_blob(image.digest, 1, db)
+    await db.commit()
+    duplicate_index.remove(image.id)
+    await response_cache.invalidate(image.id)
+    return orphan_paths
 
 
-async def file_is_image(file: UploadFile):
+async def _release_blob(digest: str, count: int, db: AsyncSession) -> list[str]:
+    query = (update(ImageBlob).where(ImageBlob.digest == digest)
+             .values(ref_count=ImageBlob.ref_count - count)
+             .returning(ImageBlob.ref_count, ImageBlob.path, ImageBlob.variants))
+    result = await db.execute(query)
+    blob = result.one_or_none()
+    if blob is None or blob.ref_count > 0:
+        return []
+    await db.execute(delete(ImageBlob).where(ImageBlob.digest == digest))
+    return [blob.path, *(blob.variants or {}).values()]
+
+
+async def release_blobs(digests: list[str], db: AsyncSession):
+    """
+    The release_blobs function drops references taken by acquire_blob or create_blob that no image owns,
+    e.g. when the images of the uploads could not be saved. A digest given twice drops two references.
+    The blobs left without references are removed in the same transaction.
+
+    :param digests: list[str]: Digests of the blobs, once per reference to drop
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The paths of the stored files (original and variants) that are no longer referenced by any image
+    :doc-author: RSA
     """
-    The file_is_image function checks if the file is an image.
+    orphan_paths = []
+    for digest, count in Counter(digests).items():
+        orphan_paths += await _release_blob(digest, count, db)
+    await db.commit()
+    return orphan_paths
+
 
+async def get_blob(blob_id: int, db: AsyncSession):
+    """
+    The get_blob function returns the stored blob with the given id.
 
-    :param file: UploadFile: Check if the file is an image
-    :return: A boolean value
+    :param blob_id: int: Specify the blob id to search for
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A blob object or None
     :doc-author: RSA
     """
-    if file.content_type.startswith("image"):
-        return True
-    else:
-        return False
+    query = select(ImageBlob).filter_by(id=blob_id)
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
 
 
-# Update File in DB
-async def update_image_title(image: Image, title: str, db: AsyncSession):
+async def update_blob_variants(blob: ImageBlob, variants: dict[str, str], db: AsyncSession):
     """
-    The update_image_title function updates the title of an image.
+    The update_blob_variants function saves the URLs of the resized variants of a blob.
+    The images stored in the blob are marked as updated and their cached responses are dropped,
+    as they list the variants.
 
-    :param image: Image: Pass the image object to the function
-    :param title: str: Pass in the new title for the image
+    :param blob: ImageBlob: The blob the variants were rendered from
+    :param variants: dict[str, str]: URLs of the variants keyed by '<width>_<format>'
     :param db: AsyncSession: Pass the database session to the function
-    :return: The updated image object
+    :return: The updated blob
     :doc-author: RSA
     """
-    image.title = title
+    blob.variants = variants
+    query = update(Image).where(Image.digest == blob.digest).values(updated_at=func.now()).returning(Image.id)
+    result = await db.execute(query)
+    image_ids = result.scalars().all()
     await db.commit()
-    await db.refresh(image)
-    return image
+    await response_cache.invalidate(*image_ids)
+    return blob
 
 
-# Delete image from DB
-async def delete_image_from_db(image: Image, db: AsyncSession):
+async def acquire_blob(digest: str, db: AsyncSession):
     """
-    The delete_image_from_db function deletes an image from the database.
+    The acquire_blob function takes a reference to an already stored blob with the given content digest.
+    The reference count is incremented atomically, so a concurrent delete of the last reference cannot remove the blob.
 
-    :param image: Image: Pass the image object to be deleted
+    :param digest: str: SHA-256 digest of the file content
     :param db: AsyncSession: Pass the database session to the function
-    :return: A coroutine
+    :return: The blob or None if the content is not stored yet
     :doc-author: RSA
     """
-    await db.delete(image)
+    query = (update(ImageBlob).where(ImageBlob.digest == digest)
+             .values(ref_count=ImageBlob.ref_count + 1).returning(ImageBlob))
+    result = await db.execute(select(ImageBlob).from_statement(query).execution_options(populate_existing=True))
+    blob = result.scalar_one_or_none()
+    await db.commit()
+    return blob
+
+
+async def create_blob(digest: str, name: str, path: str, size: int, db: AsyncSession):
+    """
+    The create_blob function records a newly stored file with one reference.
+    If a concurrent upload of the same content has already created the blob, that blob gets the reference instead,
+    so the caller should remove its own copy from the storage when the returned name differs.
+
+    :param digest: str: SHA-256 digest of the file content
+    :param name: str: Name of the file in the storage
+    :param path: str: URL of the file
+    :param size: int: Size of the file in bytes
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The blob that holds the content
+    :doc-author: RSA
+    """
+    query = (insert(ImageBlob).values(digest=digest, name=name, path=path, size=size, ref_count=1)
+             .on_conflict_do_update(index_elements=[ImageBlob.digest],
+                                    set_={'ref_count': ImageBlob.ref_count + 1})
+             .returning(ImageBlob))
+    result = await db.execute(select(ImageBlob).from_statement(query).execution_options(populate_existing=True))
+    blob = result.scalar_one()
     await db.commit()
+    return blob
 
 
-async def get_images_by_tag(tag_name: str, limit: int, offset: int, db: AsyncSession):
+async def get_images_by_tag(tag_name: str, limit: int, offset: int, db: AsyncSession,
+                            after: tuple[datetime, int] | None = None):
     """
     The get_images_by_tag function takes in a tag name, limit, offset and database session.
     It then queries the Tag table for the given tag name. If it finds a match it will query
@@ -163,19 +283,38 @@ async def get_images_by_tag(tag_name: str, limit: int, offset: int, db: AsyncSes
     :param limit: int: Limit the number of images returned
     :param offset: int: Skip a certain number of images
     :param db: AsyncSession: Pass in the database session to the function
+    :param after: tuple[datetime, int] | None: Key of the last image of the previous page, used instead of offset
     :return: A list of images with a given tag
     :doc-author: RSA
     """
-    query = select(Tag).filter_by(name=tag_name)
-    tag = await db.execute(query)
-    tag = tag.unique().scalar_one_or_none()
-    if tag:
-        query = (
-            select(Image).filter(Image.tags.contains(tag)).offset(offset).limit(limit)
-        )
-        images = await db.execute(query)
-        return images.unique().scalars().all()
-    return
+    return await search_images_by_tags([tag_name], True, limit, offset, db, after)
+
+
+async def search_images_by_tags(tag_names: list[str], match_all: bool, limit: int, offset: int, db: AsyncSession,
+                                after: tuple[datetime, int] | None = None):
+    """
+    The search_images_by_tags function returns the images that carry all, or any, of the given tags, newest first.
+    The tags are matched in a single query: the links of the named tags are grouped by image in image_to_tag,
+    and with match_all only the images linked to every one of the tags are kept.
+
+    :param tag_names: list[str]: Names of the tags
+    :param match_all: bool: Require all the tags instead of any of them
+    :param limit: int: Limit the number of images returned
+    :param offset: int: Skip a certain number of images
+    :param db: AsyncSession: Pass in the database session to the function
+    :param after: tuple[datetime, int] | None: Key of the last image of the previous page, used instead of offset
+    :return: A list of images with the tags
+    :doc-author: RSA
+    """
+    matches = (select(ImageToTag.image_id)
+               .join(Tag, Tag.id == ImageToTag.tag_id)
+               .where(Tag.name.in_(tag_names))
+               .group_by(ImageToTag.image_id))
+    if match_all:
+        matches = matches.having(func.count(distinct(ImageToTag.tag_id)) == len(tag_names))
+    query = paginate(select(Image).options(*IMAGE_LIST_LOAD).where(Image.id.in_(matches)), Image, limit, offset, after)
+    images = await db.execute(query)
+    return images.scalars().all()
 
 
 async def add_tag_to_image(image_id: int, tag_name: str, db: AsyncSession):
@@ -191,17 +330,17 @@ async def add_tag_to_image(image_id: int, tag_name: str, db: AsyncSession):
     :return: An image object
     :doc-author: RSA
     """
-    query = select(Image).filter_by(id=image_id)
+    query = select(Image).options(selectinload(Image.tags)).filter_by(id=image_id)
     image = await db.execute(query)
-    image = image.unique().scalar_one_or_none()
+    image = image.scalar_one_or_none()
     tag = await create_tag(tag_name.strip(), db)
     if image:
         if tag not in image.tags and image.count_tags <= settings.max_add_tags - 1:
             image.count_tags += 1
             image.tags.append(tag)
             await db.commit()
-            await db.refresh(image)
-            return image
+            await response_cache.invalidate(image.id)
+            return await reload_image(image.id, db)
         else:
             if tag in image.tags:
                 raise HTTPException(
@@ -237,8 +376,8 @@ async def delete_tag_from_image(image_id: int, tag_name: str, db: AsyncSession):
             image.tags.remove(tag)
             image.count_tags -= 1
             await db.commit()
-            await db.refresh(image)
-            return image
+            await response_cache.invalidate(image.id)
+            return await reload_image(image.id, db)
         else:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -264,7 +403,7 @@ async def create_tag(tag_name: str, db: AsyncSession):
     """
     query = select(Tag).filter_by(name=tag_name)
     tag = await db.execute(query)
-    tag = tag.unique().scalar_one_or_none()
+    tag = tag.scalar_one_or_none()
     if tag is None:
         new_tag = Tag(name=tag_name)
         db.add(new_tag)
@@ -288,7 +427,8 @@ async def create_image(user: User, db: AsyncSession, **kwargs):
     :doc-author: RSA
     """
     data = ImageCreateSchema(title=kwargs['title'], path=kwargs['image_path'])
-    new_image = Image(**data.model_dump(exclude_unset=True), size=kwargs['size'], user_id=user.id)
+    new_image = Image(**data.model_dump(exclude_unset=True), size=kwargs['size'], user_id=user.id,
+                      digest=kwargs.get('digest'), **{key: kwargs.get(key) for key in IMAGE_METADATA})
 
     if kwargs['tag']:
         tag = await create_tag(kwargs['tag'], db)
@@ -296,10 +436,55 @@ async def create_image(user: User, db: AsyncSession, **kwargs):
         new_image.tags.append(tag)
     db.add(new_image)
     await db.commit()
-    await db.refresh(new_image)
+    new_image = await reload_image(new_image.id, db)
+    duplicate_index.add(new_image.id, new_image.phash)
+    await response_cache.invalidate()
     return new_image
 
 
+async def create_images(user: User, items: list[dict], db: AsyncSession):
+    """
+    The create_images function creates several images of a user in a single transaction.
+    The tags of all the images are looked up with one query and the missing ones are created
+    in the same transaction, so either every image of the batch is saved or none is.
+
+    :param user: User: The owner of the images
+    :param items: list[dict]: One dict per image with the size, image_path, digest, title, tag and metadata keys
+    :param db: AsyncSession: Access the database
+    :return: The list of the created images in the order of the items
+    :doc-author: RSA
+    """
+    if not items:
+        return []
+    tag_names = {item['tag'] for item in items if item['tag']}
+    tags = {}
+    if tag_names:
+        result = await db.execute(select(Tag).where(Tag.name.in_(tag_names)))
+        tags = {tag.name: tag for tag in result.scalars().all()}
+        for name in tag_names - tags.keys():
+            tags[name] = Tag(name=name)
+            db.add(tags[name])
+    new_images = []
+    for item in items:
+        data = ImageCreateSchema(title=item['title'], path=item['image_path'])
+        new_image = Image(**data.model_dump(exclude_unset=True), size=item['size'], user_id=user.id,
+                          digest=item.get('digest'), **{key: item.get(key) for key in IMAGE_METADATA})
+        if item['tag']:
+            new_image.count_tags = 1
+            new_image.tags.append(tags[item['tag']])
+        db.add(new_image)
+        new_images.append(new_image)
+    await db.commit()
+    ids = [image.id for image in new_images]
+    query = select(Image).options(*IMAGE_LOAD).where(Image.id.in_(ids)).execution_options(populate_existing=True)
+    result = await db.execute(query)
+    created = {image.id: image for image in result.scalars().all()}
+    for image in created.values():
+        duplicate_index.add(image.id, image.phash)
+    await response_cache.invalidate()
+    return [created[image_id] for image_id in ids]
+
+
 async def format_filename():
     """
     The format_filename function takes no arguments and returns a string.
@@ -313,19 +498,6 @@ async def format_filename():
     return new_filename
 
 
-async def get_filename_from_cloudinary_url(cloudinary_url):
-    """
-    The get_filename_from_cloudinary_url function takes a Cloudinary URL as input and returns the filename of the image.
-
-    :param cloudinary_url: Get the filename from the url
-    :return: The filename from the cloudinary url
-    :doc-author: RSA
-    """
-    parts = cloudinary_url.split("/")
-    filename = parts[-1]
-    return filename
-
-
 async def get_user_by_email(email: str, db: AsyncSession):
     """
     The get_user_by_email function takes in an email and a database session,
@@ -339,3 +511,24 @@ async def get_user_by_email(email: str, db: AsyncSession):
     query = select(User).where(User.email == email)
     user = await db.execute(query)
     return user.unique().scalar_one_or_none()
+
+
+async def get_duplicates(image: Image, max_distance: int, db: AsyncSession):
+    """
+    The get_duplicates function finds the images that look like the given one:
+    those whose perceptual hash is within max_distance bits of its hash, the image itself excluded.
+
+    :param image: Image: The image to find the duplicates of
+    :param max_distance: int: The largest Hamming distance between the hashes
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of (distance, image) pairs, nearest first
+    :doc-author: RSA
+    """
+    found = [(distance, image_id) for distance, image_id in
+             await duplicate_index.search(image.phash, max_distance, db) if image_id != image.id]
+    if not found:
+        return []
+    query = select(Image).options(*IMAGE_LIST_LOAD).where(Image.id.in_([image_id for distance, image_id in found]))
+    result = await db.execute(query)
+    images = {image.id: image for image in result.scalars().all()}
+    return [(distance, images[image_id]) for distance, image_id in found if image_id in images]
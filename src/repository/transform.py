@@ -1,11 +1,10 @@
-from io import BytesIO
-
-import cloudinary
-import qrcode
-from cloudinary.utils import cloudinary_url
-
-from src.repository import images as repository_images
 from src.conf.config import settings
+from src.services.executor import image_executor
+from src.services.imaging import render_qr_code
+from src.services.storage import storage_service
+from src.utils.lru import LRUCache
+
+qr_code_cache = LRUCache(settings.qr_code_cache_size)
 
 
 async def transform_image(image_url, transformation_options=None):
@@ -19,38 +18,28 @@ async def transform_image(image_url, transformation_options=None):
     :return: A transformed image url
     :doc-author: RSA
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True)
-
     # Transform image in cloudinary
     # transformed_url = image_url
-    name = await repository_images.get_filename_from_cloudinary_url(image_url)
+    name = storage_service.name_from_url(image_url)
     if transformation_options:
-        transformed_url, options = cloudinary_url(f"PhotoShareApp/{name}", **transformation_options)
+        transformed_url = storage_service.url(name, **transformation_options)
         return transformed_url
 
 
-async def generate_qr_code(data):
-
+async def generate_qr_code(data: str, fmt: str = 'png') -> bytes:
     """
     The generate_qr_code function takes in a string of data and returns a QR code image.
+    The image is rendered in memory in the image process pool and memoized by data and format,
+    so repeated requests for the same URL do not render it again.
 
     :param data: Store the data that is to be encoded in the qr code
-    :return: A qr code image
+    :param fmt: str: Format of the image, 'png' or 'svg'
+    :return: The encoded qr code image
     :doc-author: RSA
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-
-    return qr_image
+    key = (data, fmt)
+    qr_code = qr_code_cache.get(key)
+    if qr_code is None:
+        qr_code = await image_executor.run(render_qr_code, data, fmt)
+        qr_code_cache.put(key, qr_code)
+    return qr_code
@@ -8,6 +8,7 @@ from libgravatar import Gravatar
 from src.database.db import get_db
 from src.models.models import User, Role, BlackList
 from src.schemas.user import UserCreateSchema
+from src.services.user_cache import user_cache
 
 
 async def get_user_by_id(user_id: uuid.UUID, db: AsyncSession = Depends(get_db)) -> User | None:
@@ -69,20 +70,6 @@ async def get_user_by_email(email: str, db: AsyncSession = Depends(get_db)) -> U
     return user.scalar_one_or_none()
 
 
-async def update_token(user: User, token: str | None, db: AsyncSession):
-    """
-    The update_token function updates the refresh token for a user.
-
-    :param user: User: Identify the user to update
-    :param token: str | None: Update the refresh token of the user
-    :param db: AsyncSession: Pass the database session to the function
-    :return: The user object
-    :doc-author: RSA
-    """
-    user.refresh_token = token
-    await db.commit()
-
-
 async def confirmed_email(email: str, db: AsyncSession):
     """
     The confirmed_email function takes in an email and a database session,
@@ -98,6 +85,7 @@ async def confirmed_email(email: str, db: AsyncSession):
     user.confirmed = True
     user.is_active = True
     await db.commit()
+    await user_cache.invalidate(email)
 
 
 async def update_avatar(email, url: str, db: AsyncSession) -> User:
@@ -113,6 +101,7 @@ async def update_avatar(email, url: str, db: AsyncSession) -> User:
     user = await get_user_by_email(email, db)
     user.avatar = url
     await db.commit()
+    await user_cache.invalidate(email)
     await db.refresh(user)
     return user
 
@@ -131,5 +120,6 @@ async def update_password(user: User, new_password: str, db: AsyncSession) -> Us
     """
     user.password = new_password
     await db.commit()
+    await user_cache.invalidate(user.email)
     await db.refresh(user)
     return user
@@ -1,5 +1,4 @@
 from typing import Optional
-import cloudinary.uploader
 from fastapi import APIRouter, Form, HTTPException, Depends, Path, Query, Response, status
 import requests
 from sqlalchemy import select
@@ -11,6 +10,9 @@ from src.schemas.image import ImageReadSchema, ImageUpdateSchema
 from src.models.models import Image, User, Role
 from src.services.role import RoleAccess
 from src.services.auth import auth_service
+from src.services.storage import storage_service
+from src.services.file_cache import download_cache
+from src.services.cache import response_cache
 from src.database.db import get_db
 from src.repository import users as repository_users
 from src.repository import images as repository_images
@@ -92,6 +94,30 @@ async def update_user_role(
     return {"message": f"User role updated to {body.role}"}
 
 
+@router.get("/download_cache", dependencies=[Depends(role_admin)])
+async def get_download_cache_stats():
+    """
+    The get_download_cache_stats function returns the counters of the local download cache of this worker
+    and the entries and size of its directory, which is shared by the workers, to size the cache for the traffic.
+
+    :return: A dictionary with the hits, misses, coalesced misses, evictions and size of the cache
+    :doc-author: RSA
+    """
+    return download_cache.stats()
+
+
+@router.get("/response_cache", dependencies=[Depends(role_admin)])
+async def get_response_cache_stats():
+    """
+    The get_response_cache_stats function returns the hit and miss counters of the response cache
+    of this worker, by endpoint.
+
+    :return: A dictionary with the hits and misses of the image, all and tag endpoints
+    :doc-author: RSA
+    """
+    return response_cache.stats()
+
+
 @router.delete('/admin/delete/{image_id}/delete_image', status_code=status.HTTP_204_NO_CONTENT,
                dependencies=[Depends(role_admin_moderator)])
 async def admin_delete_image(body: ImageRequest = Depends(),
@@ -99,8 +125,8 @@ async def admin_delete_image(body: ImageRequest = Depends(),
     """
     The admin_delete_image function is used to delete an image from the database and cloudinary.
     The function takes in a body of type ImageRequest, which contains the id of the image to be deleted.
-    It then queries for that image in the database, and if it exists, deletes it from both cloudinary
-    and our own database.
+    It then queries for that image in the database, and if it exists, deletes it from our own database,
+    and from the storage when it was the last image referencing the stored file.
 
     :param body: ImageRequest: Get the image_id from the request body
     :param db: AsyncSession: Get the database session
@@ -110,17 +136,14 @@ async def admin_delete_image(body: ImageRequest = Depends(),
     image = await repository_images.get_image(body.image_id, db)
 
     if image:
-        image_name = await repository_images.get_filename_from_cloudinary_url(image.path)
-        # response = requests.get(image.path, stream=True)
-        # if response.status_code == 200:
-        try:
-            cloudinary.uploader.destroy(f'PhotoShareApp/{image_name}')
-            await repository_images.delete_image_from_db(image, db)
-
-            return Response(status_code=status.HTTP_204_NO_CONTENT)
-        except Exception:
-            await repository_images.delete_image_from_db(image, db)
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+        orphan_paths = await repository_images.delete_image_from_db(image, db)
+        for orphan_path in orphan_paths:
+            try:
+                await storage_service.delete(storage_service.name_from_url(orphan_path))
+            except Exception as err:
+                print(err)
+
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
@@ -1,7 +1,7 @@
 import secrets
 
 from fastapi import APIRouter, Depends, HTTPException, status, Security, Request, BackgroundTasks
-from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
@@ -9,15 +9,16 @@ from src.models.models import User
 from src.repository import users as repository_users
 from src.schemas.user import UserCreateSchema, TokenSchema, UserResponseSchema, RequestEmail, ConfirmationResponse, \
     LogoutResponseSchema
-from src.services.auth import auth_service
+from src.services.auth import auth_service, AuthContext, HTTPBearerContext
+from src.services.blacklist import token_blacklist
+from src.services.sessions import session_store
 from src.services.email import send_email
 from src.conf import messages
+from src.conf.config import settings
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-blacklisted_tokens = set()
-
-get_refresh_token = HTTPBearer()
+get_refresh_token = HTTPBearerContext(scheme_name="HTTPBearer")
 
 
 @router.post("/signup/", response_model=UserResponseSchema, status_code=status.HTTP_201_CREATED)
@@ -51,13 +52,17 @@ async def signup(background_tasks: BackgroundTasks,
 
 
 @router.post("/login", response_model=TokenSchema)
-async def login(body: OAuth2PasswordRequestForm = Depends(),
+async def login(request: Request,
+                body: OAuth2PasswordRequestForm = Depends(),
                 db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
     It takes the username and password from the request body,
     verifies them against the database, and returns an access token.
+    A password hash made with an outdated bcrypt cost is replaced with a new one.
+    Every login starts a new session, so the user can be logged in on several devices at once.
 
+    :param request: Request: Get the User-Agent that describes the device of the session
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
     :param db: AsyncSession: Get the database session
     :return: A dictionary with the access_token, refresh_token and token type
@@ -70,59 +75,69 @@ async def login(body: OAuth2PasswordRequestForm = Depends(),
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.NOT_CONFIRMED_EMAIL)
     if not user.is_active:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.INACTIVE_USER)
-    if not await auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.verify_and_update_password(body.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.INVALID_PASSWORD)
-
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token_ = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token_, db)
+    if new_hash is not None:
+        await repository_users.update_password(user, new_hash, db)
+
+    sid = session_store.new_sid()
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "sid": sid})
+    refresh_token_ = await auth_service.create_refresh_token(data={"sub": user.email, "sid": sid},
+                                                             expires_delta=settings.session_ttl)
+    await session_store.open(sid, user.email, refresh_token_, request.headers.get("User-Agent"))
     return {"access_token": access_token, "refresh_token": refresh_token_, "token_type": "bearer"}
 
 
 @router.post("/logout", response_model=LogoutResponseSchema)
-async def logout(access_token: str = Depends(auth_service.get_user_access_token),
-                 user: User = Depends(auth_service.get_current_user),
-                 db: AsyncSession = Depends(get_db)) -> dict:
+async def logout(context: AuthContext = Depends(auth_service.oauth2_scheme),
+                 user: User = Depends(auth_service.get_current_user)) -> dict:
     """
     The logout function is used to logout a user.
     It takes an access token as input and returns a message indicating that the logout was successful.
+    The access token is blacklisted on all workers until it expires and the session of the token is ended,
+    so its refresh token cannot be used anymore.
 
-    :param access_token: str: Get the access token from the authorization header
+    :param context: AuthContext: Get the access token and its expiration time from the auth context of the request
     :param user: User: Get the user that is currently logged in
-    :param db: AsyncSession: Get a database session
     :return: A dict with a message
     :doc-author: RSA
     """
-    blacklisted_tokens.add(access_token)
-    user.refresh_token = None
-    await db.commit()
+    await token_blacklist.revoke(context.token, context.expires_at)
+    if context.payload.get("sid") is not None:
+        await session_store.close(context.payload["sid"], user.email)
     return {"message": "Logout successful."}
 
 
 @router.get('/refresh_token', response_model=TokenSchema)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(get_refresh_token),
+async def refresh_token(context: AuthContext = Security(get_refresh_token),
                         db: AsyncSession = Depends(get_db)) -> dict:
     """
     The refresh_token function is used to refresh the access token.
     The function takes in a refresh token and returns an access token, a new refresh token, and the type of
     authentication being used (bearer). If there is no valid user associated with the given email address or if
     there are any errors during this process then an HTTPException will be raised.
+    The refresh token is rotated in the session store: it can be used only once, and using it again
+    ends its session. The users table is only read.
 
-    :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
+    :param context: AuthContext: Get the refresh token and its claims from the auth context of the request
     :param db: AsyncSession: Get the database session
     :return: A dict with the access_token, refresh_token and token type
     :doc-author: RSA
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
+    email = auth_service.refresh_subject(context)
+    sid = context.payload.get("sid")
     user = await repository_users.get_user_by_email(email, db)
-    if not secrets.compare_digest(user.refresh_token, token):
-        await repository_users.update_token(user, None, db)
+    if user is None or sid is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.INVALID_REFRESH_TOKEN)
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.INACTIVE_USER)
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token_ = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token_, db)
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid})
+    refresh_token_ = await auth_service.create_refresh_token(data={"sub": email, "sid": sid},
+                                                             expires_delta=settings.session_ttl)
+    if not await session_store.rotate(sid, email, context.token, refresh_token_):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.INVALID_REFRESH_TOKEN)
     return {"access_token": access_token, "refresh_token": refresh_token_, "token_type": "bearer"}
 
 
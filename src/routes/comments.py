@@ -1,5 +1,8 @@
 
-from fastapi import APIRouter, Depends, status, HTTPException, Query
+from typing import Optional
+
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
@@ -7,6 +10,9 @@ from src.models.models import User, Role
 from src.services.auth import auth_service
 from src.schemas.comments import CommentResponseShema, CommentResponseShemaLight
 from src.repository import comments as repository_comments
+from src.utils.pagination import decode_cursor, next_cursor_headers
+from src.utils.etag import weak_etag, etag_matches, validators, not_modified
+from src.utils.serializers import comment_row
 
 router = APIRouter(prefix="/comments", tags=["comments"])
 
@@ -38,27 +44,38 @@ async def create_comment(image_id: int,
 
 @router.get('/all', response_model=list[CommentResponseShemaLight])
 async def get_comments(
+        request: Request,
         image_id: int,
         limit: int = Query(10, ge=10, le=500),
         offset: int = Query(0, ge=0),
+        cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
         db: AsyncSession = Depends(get_db)
 ):
     """
-    The get_comments function returns a list of comments for the image with the given id.
+    The get_comments function returns a list of comments for the image with the given id, oldest first.
     The limit and offset parameters are used to paginate through results.
+    Deep pages should be read with the cursor from the X-Next-Cursor header of the previous page instead of offset.
+    The ETag of a page changes when one of its comments is edited, and an unchanged page is answered
+    with an empty 304 response when its ETag is sent in If-None-Match.
 
+    :param request: Request: Get the If-None-Match header
     :param image_id: int: Specify the image id of the comment
     :param limit: int: Limit the number of comments returned
     :param ge: Specify the minimum value of the limit parameter
     :param le: Set a maximum value for the limit parameter
     :param offset: int: Specify the offset of the first comment to be returned
     :param ge: Specify a minimum value for the integer, and le is used to specify a maximum
+    :param cursor: Optional[str]: Start after the last comment of the previous page
     :param db: AsyncSession: Pass the database session to the function
     :return: A list of comments for the image with the given id
     :doc-author: RSA
     """
-    comments = await repository_comments.get_comments(image_id, limit, offset, db)
-    return comments
+    comments = await repository_comments.get_comments(image_id, limit, offset, db, after=decode_cursor(cursor))
+    headers = {**validators(weak_etag((comment.id, comment.updated_at) for comment in comments)),
+               **next_cursor_headers(comments, limit)}
+    if etag_matches(request, headers['ETag']):
+        return not_modified(headers)
+    return ORJSONResponse([comment_row(comment) for comment in comments], headers=headers)
 
 
 @router.put("/{comment_id}", response_model=CommentResponseShema)
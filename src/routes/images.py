@@ -1,35 +1,56 @@
-from io import BytesIO
-from typing import Optional, List
+import asyncio
+from typing import Optional, List, Literal
 
-import cloudinary
-import cloudinary.uploader
-import requests
-from PIL import Image
-
-from fastapi import UploadFile, APIRouter, HTTPException, status, Depends, File, Form, Query, Path, Response
+from fastapi import UploadFile, APIRouter, HTTPException, status, Depends, File, Form, Query, Path, Response, Request, \
+    BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import ORJSONResponse
 from starlette.responses import StreamingResponse, FileResponse
 
-from src.database.db import get_db
+from src.database.db import get_db, sessionmanager
 from src.models.models import User
 from src.conf.config import settings
 from src.services.auth import auth_service
-from src.schemas.image import ImageCreateSchema, ImageReadSchema, ImageUpdateSchema
+from src.schemas.image import ImageCreateSchema, ImageReadSchema, ImageUpdateSchema, \
+    ImageBatchItemSchema, ImageDuplicateSchema
 from src.repository import images as repository_images
 from src.services.role import RoleAccess
+from src.services.upload import spool_upload, sniff_image_type, SNIFF_SIZE, upload_slots
+from src.services.ingest import store_upload, generate_variants, read_upload_metadata, release_uploads
+from src.services.storage import storage_service, open_file_stream, probe_file, LocalStorage, RangeNotSatisfiable, \
+    ObjectStream
+from src.services.file_cache import download_cache
+from src.services.cache import response_cache
+from src.utils.pagination import decode_cursor, next_cursor_headers
+from src.utils.etag import weak_etag, etag_matches, validators, not_modified, IMMUTABLE_CACHE_CONTROL
+from src.utils.serializers import image_row, dump_json
 
 router = APIRouter(prefix='/images', tags=['image'])
 
 
+def dump_images(images) -> str:
+    return dump_json([image_row(image) for image in images]).decode()
+
+
+def images_etag(images) -> str:
+    return weak_etag((image.id, image.updated_at, image.count_tags) for image in images)
+
+
 @router.get('/tag/{tag}', response_model=List[ImageReadSchema], status_code=status.HTTP_200_OK)
-async def get_images_by_tag(tag: str = Path(description="Input tag", min_length=3, max_length=50),
+async def get_images_by_tag(request: Request,
+                            tag: str = Path(description="Input tag", min_length=3, max_length=50),
                             limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+                            cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
                             db: AsyncSession = Depends(get_db)):
     """
     The get_images_by_tag function returns a list of images that have the specified tag.
     The function takes in an optional limit and offset query parameters to control how many results are returned,
     and where in the result set they start from. The default values for these parameters are 10 and 0 respectively.
+    Deep pages should be read with the cursor from the X-Next-Cursor header of the previous page instead of offset.
+    Pages are served from the response cache until an image changes and carry an ETag,
+    so a client sending it back in If-None-Match gets an empty 304 response while the page is unchanged.
 
+    :param request: Request: Get the If-None-Match header
     :param tag: str: Get the tag from the request url
     :param min_length: Specify the minimum length of the tag
     :param max_length: Limit the length of the input tag
@@ -38,14 +59,21 @@ async def get_images_by_tag(tag: str = Path(description="Input tag", min_length=
     :param le: Limit the number of images returned
     :param offset: int: Specify the number of images to skip
     :param ge: Check if the value is greater than or equal to the given number
+    :param cursor: Optional[str]: Start after the last image of the previous page
     :param db: AsyncSession: Get the database session
     :return: A list of images that contain the tag
     :doc-author: RSA
     """
-    images = await repository_images.get_images_by_tag(tag, limit, offset, db)
-    if not images:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="TAG NOT EXISTS")
-    return images
+    after = decode_cursor(cursor)
+
+    async def build():
+        images = await repository_images.get_images_by_tag(tag, limit, offset, db, after=after)
+        if not images:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="TAG NOT EXISTS")
+        return {**validators(images_etag(images)), **next_cursor_headers(images, limit)}, dump_images(images)
+
+    key = await response_cache.page_key('tag', tag, limit, offset, cursor or '')
+    return await response_cache.fetch(key, 'tag', settings.response_cache_page_ttl, build, request)
 
 
 @router.post('/{image_id}/tag/{tag}', response_model=ImageReadSchema, status_code=status.HTTP_200_OK)
@@ -96,30 +124,78 @@ async def delete_tag_from_image(
 
 
 @router.get('/all', response_model=List[ImageReadSchema], status_code=status.HTTP_200_OK)
-async def get_all_images(limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+async def get_all_images(request: Request,
+                         limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+                         cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
                          db: AsyncSession = Depends(get_db)):
     """
-    The get_all_images function returns a list of all images in the database.
+    The get_all_images function returns a list of all images in the database, newest first.
     The limit and offset parameters are used to paginate the results.
+    Deep pages should be read with the cursor from the X-Next-Cursor header of the previous page instead of offset.
+    Pages are served from the response cache until an image changes and carry an ETag,
+    so a client sending it back in If-None-Match gets an empty 304 response while the page is unchanged.
 
-
+    :param request: Request: Get the If-None-Match header
     :param limit: int: Limit the number of images returned
     :param ge: Specify the minimum value of the parameter
     :param le: Limit the number of images returned
     :param offset: int: Specify the number of records to skip before returning results
     :param ge: Specify the minimum value of the parameter
+    :param cursor: Optional[str]: Start after the last image of the previous page
     :param db: AsyncSession: Get the database connection from the dependency
     :return: A list of images
     :doc-author: RSA
     """
-    images = await repository_images.get_images(limit, offset, db)
+    after = decode_cursor(cursor)
+
+    async def build():
+        images = await repository_images.get_images(limit, offset, db, after=after)
+        if not images:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+        return {**validators(images_etag(images)), **next_cursor_headers(images, limit)}, dump_images(images)
+
+    key = await response_cache.page_key('all', limit, offset, cursor or '')
+    return await response_cache.fetch(key, 'all', settings.response_cache_page_ttl, build, request)
+
+
+@router.get('/search', response_model=List[ImageReadSchema], status_code=status.HTTP_200_OK)
+async def search_images(request: Request,
+                        tags: str = Query(description="Comma separated tag names", min_length=3),
+                        mode: Literal['all', 'any'] = Query('all'),
+                        limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+                        cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+                        db: AsyncSession = Depends(get_db)):
+    """
+    The search_images function returns the images that have all (mode=all) or any (mode=any) of the given tags,
+    newest first. It is paginated like the other image lists.
+    An unchanged page is answered with an empty 304 response when its ETag is sent in If-None-Match.
+
+    :param request: Request: Get the If-None-Match header
+    :param tags: str: Comma separated tag names
+    :param mode: str: 'all' to require every tag, 'any' for at least one of them
+    :param limit: int: Limit the number of images returned
+    :param offset: int: Specify the number of images to skip
+    :param cursor: Optional[str]: Start after the last image of the previous page
+    :param db: AsyncSession: Get the database session
+    :return: A list of images with the tags
+    :doc-author: RSA
+    """
+    tag_names = list(dict.fromkeys(name.strip() for name in tags.split(',') if name.strip()))
+    if not tag_names:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="No tags to search for")
+    images = await repository_images.search_images_by_tags(tag_names, mode == 'all', limit, offset, db,
+                                                           after=decode_cursor(cursor))
     if not images:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return images
+    headers = {**validators(images_etag(images)), **next_cursor_headers(images, limit)}
+    if etag_matches(request, headers['ETag']):
+        return not_modified(headers)
+    return ORJSONResponse([image_row(image) for image in images], headers=headers)
 
 
 @router.post("/", response_model=ImageReadSchema, status_code=status.HTTP_201_CREATED)
-async def create_image(file: UploadFile = File(..., description="The image file to upload"),
+async def create_image(background_tasks: BackgroundTasks,
+                       file: UploadFile = File(..., description="The image file to upload"),
                        title: str = Form(min_length=3, max_length=50),
                        tag: Optional[str] = None,
                        user: User = Depends(auth_service.get_current_user),
@@ -128,7 +204,10 @@ async def create_image(file: UploadFile = File(..., description="The image file
     The create_image function creates a new image in the database.
         It takes an UploadFile object, which is a file that has been uploaded to the server.
         The title and tag are optional parameters, but if they are provided they must be valid strings.
+        The dimensions, format, orientation and capture time are read from the headers of the file.
+        The resized variants of a newly stored file are rendered in the background after the response is sent.
 
+    :param background_tasks: BackgroundTasks: Render the variants after the response
     :param file: UploadFile: Get the file from the request body
     :param description: Provide a description for the image
     :param title: str: Set the title of the image
@@ -139,53 +218,153 @@ async def create_image(file: UploadFile = File(..., description="The image file
     :return: A dict with the image data
     :doc-author: RSA
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-    new_name = await repository_images.format_filename()
-    size_is_valid = await repository_images.get_file_size(file)
-    file_is_valid = await repository_images.file_is_image(file)
-    if size_is_valid > settings.max_image_size:
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                            detail=f"File too large. Max size is {settings.max_image_size} bytes")
-    if not file_is_valid:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="File is not an image. Only images are allowed")
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'PhotoShareApp/{new_name}', overwrite=True)
-    image_path = cloudinary.CloudinaryImage(f'PhotoShareApp/{new_name}')
-    image = await repository_images.create_image(size=size_is_valid, image_path=image_path.url, title=title,
-                                                 tag=tag, user=user, db=db)
+    upload = await spool_upload(file)
+    metadata = await read_upload_metadata(upload)
+    blob = await store_upload(upload, db)
+    try:
+        image = await repository_images.create_image(size=upload.size, image_path=blob.path, digest=blob.digest,
+                                                     title=title, tag=tag, user=user, db=db, **metadata)
+    except Exception:
+        await release_uploads([blob])
+        raise
+    if not blob.variants:
+        background_tasks.add_task(generate_variants, blob.id)
     return image
 
 
+@router.post("/batch", response_model=List[ImageBatchItemSchema], status_code=status.HTTP_200_OK)
+async def create_images_batch(background_tasks: BackgroundTasks,
+                              files: List[UploadFile] = File(..., description="The image files to upload"),
+                              titles: List[str] = Form(..., description="One title per file"),
+                              tags: List[str] = Form([], description="One tag per file, empty for no tag"),
+                              user: User = Depends(auth_service.get_current_user),
+                              db: AsyncSession = Depends(get_db)):
+    """
+    The create_images_batch function creates an image for each uploaded file in a single request.
+        The files are checked and stored concurrently, at most ``settings.batch_upload_parallelism`` at a time
+        for all the batches of the user, and the images of the stored files are inserted in one transaction.
+        A file that fails does not fail the batch: the result of every file is reported in the order of the files.
+
+    :param background_tasks: BackgroundTasks: Render the variants after the response
+    :param files: List[UploadFile]: The files to upload
+    :param titles: List[str]: The titles of the images, in the order of the files
+    :param tags: List[str]: The tags of the images, in the order of the files
+    :param user: User: Get the current user from the auth_service
+    :param db: AsyncSession: Get the database session
+    :return: A list with the result of each file
+    :doc-author: RSA
+    """
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Too many files. Max {settings.batch_max_files} files per batch")
+    if len(titles) != len(files) or (tags and len(tags) != len(files)):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Give one title and at most one tag per file")
+    slots = upload_slots(user.id)
+
+    async def store(title: str, file: UploadFile):
+        if not 3 <= len(title) <= 50:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Title must be from 3 to 50 characters long")
+        async with slots:
+            upload = await spool_upload(file)
+            metadata = await read_upload_metadata(upload)
+            # Every file gets its own session, an AsyncSession must not be shared by concurrent tasks
+            async with sessionmanager.session() as session:
+                blob = await store_upload(upload, session)
+        return upload, blob, metadata
+
+    results = await asyncio.gather(*[store(title, file) for title, file in zip(titles, files)],
+                                   return_exceptions=True)
+    items = [ImageBatchItemSchema(index=index, filename=file.filename, status_code=status.HTTP_201_CREATED)
+             for index, file in enumerate(files)]
+    stored = []
+    for item, result in zip(items, results):
+        if isinstance(result, HTTPException):
+            item.status_code, item.detail = result.status_code, result.detail
+        elif isinstance(result, BaseException):
+            item.status_code, item.detail = status.HTTP_500_INTERNAL_SERVER_ERROR, "Upload failed"
+        else:
+            stored.append((item, *result))
+    try:
+        images = await repository_images.create_images(
+            user, [dict(size=upload.size, image_path=blob.path, digest=blob.digest, title=titles[item.index],
+                        tag=tags[item.index].strip() or None if tags else None, **metadata)
+                   for item, upload, blob, metadata in stored], db)
+    except Exception:
+        await release_uploads([blob for item, upload, blob, metadata in stored])
+        raise
+    for (item, *_), image in zip(stored, images):
+        item.image = ImageReadSchema.model_validate(image, from_attributes=True)
+    for blob_id in {blob.id for item, upload, blob, metadata in stored if not blob.variants}:
+        background_tasks.add_task(generate_variants, blob_id)
+    return items
+
+
 @router.get('/{image_id}', response_model=ImageReadSchema, status_code=status.HTTP_200_OK)
-async def get_image(image_id: int = Path(ge=1), db: AsyncSession = Depends(get_db)):
+async def get_image(request: Request, image_id: int = Path(ge=1), db: AsyncSession = Depends(get_db)):
     """
     The get_image function returns an image with the given ID.
     If no such image exists, a 404 Not Found error is returned.
+    The image is served from the response cache until it changes. Its ETag changes with the update time
+    and tags of the image, and a matching If-None-Match header gets an empty 304 response.
 
+    :param request: Request: Get the If-None-Match header
     :param image_id: int: Get the image id from the path
     :param db: AsyncSession: Pass the database connection to the function
     :return: A dictionary with the following keys:
     :doc-author: RSA
     """
+
+    async def build():
+        image = await repository_images.get_image(image_id, db)
+        if not image:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+        return validators(images_etag([image])), dump_json(image_row(image)).decode()
+
+    key = await response_cache.image_key(image_id)
+    return await response_cache.fetch(key, 'image', settings.response_cache_image_ttl, build, request)
+
+
+@router.get('/{image_id}/duplicates', response_model=List[ImageDuplicateSchema], status_code=status.HTTP_200_OK)
+async def get_image_duplicates(image_id: int = Path(ge=1),
+                               max_distance: int = Query(10, ge=0, le=16),
+                               db: AsyncSession = Depends(get_db)):
+    """
+    The get_image_duplicates function returns the images that look like the given one,
+    e.g. resized or recompressed copies of the same photo, nearest first.
+    Two images are considered alike when their 64-bit perceptual hashes differ in at most max_distance bits.
+
+    :param image_id: int: Get the image id from the path
+    :param max_distance: int: The largest number of differing bits of the hashes
+    :param db: AsyncSession: Pass the database connection to the function
+    :return: A list of the similar images with their distance
+    :doc-author: RSA
+    """
     image = await repository_images.get_image(image_id, db)
     if not image:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return image
+    if image.phash is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image has no perceptual hash")
+    duplicates = await repository_images.get_duplicates(image, max_distance, db)
+    return ORJSONResponse([{'distance': distance, 'image': image_row(duplicate)} for distance, duplicate in duplicates])
 
 
-@router.get('/download/{image_id}', response_model=ImageReadSchema, status_code=status.HTTP_200_OK)
-async def download_picture(image_id: int = Path(ge=1), db: AsyncSession = Depends(get_db)):
+@router.get('/download/{image_id}', response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def download_picture(request: Request, image_id: int = Path(ge=1), db: AsyncSession = Depends(get_db)):
     """
-    The download_picture function downloads a picture from the database.
-        The function takes an image_id as input and returns the image if it exists in the database.
-        If not, it raises a 404 error.
-
+    The download_picture function downloads a picture from the storage.
+        The function takes an image_id as input and streams the stored file through in chunks,
+        forwarding its Content-Type and Content-Length. A single byte range can be requested with the Range header.
+        Files are read through the local download cache when it is enabled. A whole cached file is sent with
+        FileResponse, which servers supporting it send by path with sendfile; a range of it is read through
+        a memory map. The cache keeps files it sent recently, and a file evicted meanwhile is streamed
+        from the storage instead. Objects larger than the cache are passed through as they are fetched.
+        If the image does not exist, it raises a 404 error.
+        The file of an image never changes, so it is sent as cacheable for good, with an ETag of its content
+        that makes a matching If-None-Match request return an empty 304 response without reading the file.
+
+    :param request: Request: Get the Range and If-None-Match headers of the request
     :param image_id: int: Specify the image id of the image that is to be downloaded
     :param db: AsyncSession: Pass the database session to the function
     :return: A streamingresponse object, which is a special type of response that allows
@@ -193,29 +372,89 @@ async def download_picture(image_id: int = Path(ge=1), db: AsyncSession = Depend
     """
     image = await repository_images.get_image(image_id, db)
     if image:
+        etag = f'"{image.digest}"' if image.digest else weak_etag([image.path])
+        cache_headers = validators(etag, IMMUTABLE_CACHE_CONTROL)
+        if etag_matches(request, etag):
+            return not_modified(cache_headers)
+        name = storage_service.name_from_url(image.path)
+        byte_range = request.headers.get('range')
+
+        headers = {'Accept-Ranges': 'bytes', **cache_headers}
+
+        async def open_origin():
+            return await storage_service.open_stream(name)
+
         try:
-            response = requests.get(image.path, stream=True)
-            if response.status_code == 200:
-                image_bytes = response.content
-                image_show = Image.open(BytesIO(image_bytes))
-                image_show.save("image.png")
-                return FileResponse("image.png")
-                # return StreamingResponse(response.iter_content(chunk_size=1024),
-                #                 media_type=response.headers['content-type'])
-            else:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+            cached = await download_cache.fetch(download_cache.key(image), open_origin) \
+                if download_cache.enabled else None
+            stream = None
+            if isinstance(cached, ObjectStream):
+                # Larger than the cache: pass it through, unless only a range of it was requested
+                if byte_range:
+                    await cached.aclose()
+                else:
+                    stream = cached
+            elif cached is not None:
+                try:
+                    if not byte_range:
+                        stat_result, media_type = probe_file(cached)
+                        return FileResponse(cached, stat_result=stat_result, headers=headers,
+                                            media_type=media_type or "application/octet-stream")
+                    stream = open_file_stream(cached, byte_range)
+                except FileNotFoundError:
+                    # Evicted by another fill, read it from the storage
+                    pass
+            if stream is None:
+                stream = await storage_service.open_stream(name, byte_range)
+        except RangeNotSatisfiable as err:
+            headers = {'Content-Range': f'bytes */{err.size}'} if err.size is not None else None
+            raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                                detail="Range not satisfiable", headers=headers)
         except Exception:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+
+        if stream.content_length is not None:
+            headers['Content-Length'] = str(stream.content_length)
+        if stream.content_range:
+            headers['Content-Range'] = stream.content_range
+        return StreamingResponse(stream.body(), status_code=stream.status_code, headers=headers,
+                                 media_type=stream.media_type or "application/octet-stream")
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
 
+@router.get('/media/{name}', include_in_schema=False)
+async def get_media(name: str):
+    """
+    The get_media function serves an image stored by the local storage backend.
+    FileResponse hands the file to the server as a path, so servers that support it send it with sendfile.
+    Stored files are never rewritten under the same name, so they are sent as cacheable for good.
+
+    :param name: str: Name of the object in the storage
+    :return: The file of the image
+    :doc-author: RSA
+    """
+    if not isinstance(storage_service, LocalStorage):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    try:
+        path = storage_service.path(name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    if not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    with open(path, 'rb') as file:
+        media_type = sniff_image_type(file.read(SNIFF_SIZE))
+    return FileResponse(path, media_type=media_type or "application/octet-stream",
+                        headers={'Cache-Control': IMMUTABLE_CACHE_CONTROL})
+
+
 @router.delete('/{image_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_image(image_id: int = Path(ge=1),
                        user: User = Depends(auth_service.get_current_user),
                        db: AsyncSession = Depends(get_db)):
     """
-    The delete_image function deletes an image from the database and cloudinary.
+    The delete_image function deletes an image from the database, and from the storage
+    when it was the last image referencing the stored file.
     The function takes in a user object, which is used to verify that the user has permission to delete this image.
     It also takes in an integer representing the id of the image we want to delete.
 
@@ -225,24 +464,16 @@ async def delete_image(image_id: int = Path(ge=1),
     :return: A dictionary with the key &quot;detail&quot; and value &quot;image successfully deleted&quot;
     :doc-author: RSA
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
     image = await repository_images.get_user_image(image_id, user, db)
 
     if image:
-        image_name = await repository_images.get_filename_from_cloudinary_url(image.path)
-        try:
-            cloudinary.uploader.destroy(f'PhotoShareApp/{image_name}')
-            await repository_images.delete_image_from_db(image, db)
-            return {'ditail': 'Image successfully deleted'}
-        except Exception:
-            await repository_images.delete_image_from_db(image, db)
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+        orphan_paths = await repository_images.delete_image_from_db(image, db)
+        for orphan_path in orphan_paths:
+            try:
+                await storage_service.delete(storage_service.name_from_url(orphan_path))
+            except Exception as err:
+                print(err)
+        return {'ditail': 'Image successfully deleted'}
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
@@ -272,7 +503,9 @@ async def update_image(image_id: int = Path(ge=1),
 
 
 @router.get('/', response_model=list[ImageReadSchema], status_code=status.HTTP_200_OK)
-async def get_images_by_user(limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+async def get_images_by_user(request: Request,
+                             limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0),
+                             cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
                              db: AsyncSession = Depends(get_db),
                              user: User = Depends(auth_service.get_current_user)):
     """
@@ -280,18 +513,25 @@ async def get_images_by_user(limit: int = Query(10, ge=10, le=500), offset: int
     The function takes in the following parameters:
         limit - an integer that specifies how many images should be returned at once (defaults to 10)
         offset - an integer that specifies where in the list of all images uploaded by a user, we should start returning from (defaults to 0)
+        cursor - the X-Next-Cursor header of the previous page, to read deep pages without skipping rows
+    An unchanged page is answered with an empty 304 response when its ETag is sent in If-None-Match.
 
+    :param request: Request: Get the If-None-Match header
     :param limit: int: Limit the number of images returned
     :param ge: Specify the minimum value for a parameter, and le is used to specify the maximum value
     :param le: Limit the number of images returned to a maximum of 500
     :param offset: int: Skip the first offset number of images
     :param ge: Specify the minimum value, and le is used to specify the maximum value
+    :param cursor: Optional[str]: Start after the last image of the previous page
     :param db: AsyncSession: Get the database session
     :param user: User: Get the user from the auth_service
     :return: A list of images
     :doc-author: RSA
     """
-    images = await repository_images.get_user_images(limit, offset, user, db)
+    images = await repository_images.get_user_images(limit, offset, user, db, after=decode_cursor(cursor))
     if not images:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return images
+    headers = {**validators(images_etag(images)), **next_cursor_headers(images, limit)}
+    if etag_matches(request, headers['ETag']):
+        return not_modified(headers)
+    return ORJSONResponse([image_row(image) for image in images], headers=headers)
@@ -1,11 +1,10 @@
-import cloudinary
-import cloudinary.uploader
-import requests
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal
+from urllib.parse import urljoin
+
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Path, Query, Response
 from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.responses import FileResponse
 
 from src.conf.config import settings
 from src.database.db import get_db
@@ -15,65 +14,104 @@ from src.repository import transform as repository_transform
 
 from src.conf.transform import TRANSFORM_METHOD
 from src.schemas.image import ImageReadSchema
-from src.schemas.transform import TransformedImageRequest
+from src.schemas.transform import TransformedImageRequest, TransformJobSchema
 from src.services.auth import auth_service
+from src.services.imaging import QR_CODE_MEDIA_TYPES
+from src.services.jobs import job_queue
+from src.services.transform import TRANSFORM_JOB
 
 router = APIRouter(prefix='/cloudinary_transform', tags=['cloudinary_transform'])
 
 transform_list = list(TRANSFORM_METHOD.keys())
 
 
-@router.post('/{image_id}')
-async def create_transformed_image(body: TransformedImageRequest = Depends(),
+async def qr_code_response(request: Request, image_path: str, fmt: str = 'png') -> Response:
+    """
+    The qr_code_response function renders the QR code of an image URL and returns it as the response body.
+    Relative URLs of the local storage are made absolute, so the QR code can be opened from a phone.
+
+    :param request: Request: Get the base_url of the request
+    :param image_path: str: URL of the image
+    :param fmt: str: Format of the qr code, 'png' or 'svg'
+    :return: A response with the qr code image
+    :doc-author: RSA
+    """
+    qr_code = await repository_transform.generate_qr_code(urljoin(str(request.base_url), image_path), fmt)
+    return Response(content=qr_code, media_type=QR_CODE_MEDIA_TYPES[fmt])
+
+
+@router.get('/jobs/{job_id}', response_model=TransformJobSchema)
+async def get_transform_job(job_id: str,
+                            user: User = Depends(auth_service.get_current_user),
+                            db: AsyncSession = Depends(get_db)):
+    """
+    The get_transform_job function reports the status of a transformation job of the current user.
+    Once the job is done, the created image is returned with it; its QR code is at ``/{image_id}/qr``.
+
+    :param job_id: str: Id of the job
+    :param user: User: Get the current user from the database
+    :param db: AsyncSession: Get the database session
+    :return: The job with its status, attempts, last error and the created image
+    :doc-author: RSA
+    """
+    job = await job_queue.get(job_id)
+    if job is None or job.kind != TRANSFORM_JOB or job.payload['user_id'] != str(user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    image = None
+    if job.result:
+        image = await repository_images.get_image(job.result['image_id'], db)
+    return TransformJobSchema(id=job.id, status=job.status, attempts=job.attempts, error=job.error,
+                              image=ImageReadSchema.model_validate(image) if image else None)
+
+
+@router.get('/{image_id}/qr', response_class=Response)
+async def get_qr_code(request: Request,
+                      image_id: int = Path(ge=1),
+                      fmt: Literal['png', 'svg'] = Query('png', alias='format'),
+                      db: AsyncSession = Depends(get_db)):
+    """
+    The get_qr_code function returns the QR code of an existing (transformed) image
+    without running the transformation again.
+
+    :param request: Request: Get the base_url of the request
+    :param image_id: int: Id of the image
+    :param fmt: str: Format of the qr code, 'png' or 'svg'
+    :param db: AsyncSession: Get the database session
+    :return: The qr code image
+    :doc-author: RSA
+    """
+    image = await repository_images.get_image(image_id, db)
+    if image is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    return await qr_code_response(request, image.path, fmt)
+
+
+@router.post('/{image_id}', response_model=TransformJobSchema, status_code=status.HTTP_202_ACCEPTED)
+async def create_transformed_image(request: Request,
+                                   response: Response,
+                                   body: TransformedImageRequest = Depends(),
                                    user: User = Depends(auth_service.get_current_user),
                                    db: AsyncSession = Depends(get_db)):
     """
-    The create_transformed_image function is used to create a transformed image.
-    The function takes in the following parameters:
-        body: TransformedImageRequest = Depends(),
-        user: User = Depends(auth_service.get_current_user),
-        db: AsyncSession = Depends(get_db)
+    The create_transformed_image function queues the transformation of an image.
+    The transformation itself, the upload of the transformed copy and the creation of its image record
+    are done by a job worker, so the request does not wait for Cloudinary.
+    The job can be followed at the URL of the Location header.
 
+    :param request: Request: Build the URL of the job
+    :param response: Response: Set the Location header
     :param body: TransformedImageRequest: Get the image_id and method from the request
     :param user: User: Get the current user from the database
     :param db: AsyncSession: Get the database session
-    :return: A streaming response of the qr code, which is then displayed in the browser
+    :return: The queued job
     :doc-author: RSA
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
+    if body.method not in TRANSFORM_METHOD.keys():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Method not found")
     image = await repository_images.get_image(body.image_id, db)
-    if image:
-        try:
-            # response = requests.get(image.path, stream=True)
-            # if response.status_code == 200:
-            if body.method not in TRANSFORM_METHOD.keys():
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Method not found")
-
-            transformed_image = await repository_transform.transform_image(image.path,
-                                                                           transformation_options=TRANSFORM_METHOD[
-                                                                               body.method])
-            new_name = await repository_images.format_filename()
-            r = cloudinary.uploader.upload(transformed_image, public_id=f'PhotoShareApp/{new_name}')
-            image_path = cloudinary.CloudinaryImage(f'PhotoShareApp/{new_name}')
-            image = await repository_images.create_image(size=image.size,
-                                                         image_path=image_path.url,
-                                                         title=f"{image.title} {body.method}",
-                                                         user=user,
-                                                         tag=None,
-                                                         db=db)
-
-            qr_code = await repository_transform.generate_qr_code(transformed_image)
-            qr_code.save("qr_code.png")
-            return FileResponse("qr_code.png")
-            # else:
-            #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-        except Exception as e:
-            print(e)
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-    else:
+    if image is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    job = await job_queue.enqueue(TRANSFORM_JOB, {'image_id': image.id, 'method': body.method,
+                                                  'user_id': str(user.id)})
+    response.headers['Location'] = str(request.url_for('get_transform_job', job_id=job.id))
+    return TransformJobSchema(id=job.id, status=job.status)
@@ -2,8 +2,6 @@ from urllib import request
 
 from fastapi import APIRouter, Depends, status, UploadFile, File, Request, BackgroundTasks, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-import cloudinary
-import cloudinary.uploader
 from fastapi.templating import Jinja2Templates
 from starlette.responses import HTMLResponse
 
@@ -11,6 +9,8 @@ from src.database.db import get_db
 from src.models.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.storage import storage_service
+from src.services.sessions import session_store
 from src.conf.config import settings
 from src.schemas.user import UserDbSchema, RequestEmail, RequestNewPassword
 from src.services.email import send_email_reset_password
@@ -47,16 +47,8 @@ async def update_avatar_user(file: UploadFile = File(), current_user: User = Dep
     :return: A user object
     :doc-author: RSA
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'PhotoShareApp/{current_user.fullname}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'PhotoSharesApp/{current_user.fullname}') \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
+    stored = await storage_service.upload(file.file, current_user.fullname)
+    src_url = storage_service.url(stored.name, width=250, height=250, crop='fill', version=stored.version)
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
 
@@ -97,6 +89,7 @@ async def reset_password(token:  str,
     to get the email of the user who requested a password reset. It then gets that user from
     the database, hashes their new password, and updates their account with this new hashed
     password.
+    The user is logged out of all the sessions, on every device.
 
     :param token:  str: Get the token from the url
     :param request_: Request: Get the form data from the request
@@ -116,6 +109,7 @@ async def reset_password(token:  str,
 
     new_password = await auth_service.get_password_hash(new_password)
     await repository_users.update_password(user, new_password, db)
+    await session_store.close_all(email)
     return {"message": "Password reset successfully"}
 
 
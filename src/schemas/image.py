@@ -20,10 +20,29 @@ class ImageReadSchema(BaseModel):
     count_tags: Optional[int] = 0
     tags: list[TagSchema]
     owner: UserReadSchema
+    variants: dict[str, str] = {}
+    width: Optional[int] = None
+    height: Optional[int] = None
+    format: Optional[str] = None
+    orientation: Optional[int] = None
+    taken_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class ImageBatchItemSchema(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status_code: int
+    detail: Optional[str] = None
+    image: Optional[ImageReadSchema] = None
+
+
+class ImageDuplicateSchema(BaseModel):
+    distance: int
+    image: ImageReadSchema
+
+
 class ImageCreateSchema(BaseModel):
     path: str
     title: str
@@ -1,5 +1,5 @@
 import enum
-from typing import Literal
+from typing import Literal, Optional
 
 from fastapi import Path
 from pydantic import BaseModel
@@ -22,3 +22,10 @@ class TransformedImageRequest(BaseModel):
 class TransformedImageResponse(BaseModel):
     image: ImageReadSchema
 
+
+class TransformJobSchema(BaseModel):
+    id: str
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    image: Optional[ImageReadSchema] = None
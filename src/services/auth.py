@@ -1,31 +1,152 @@
+import hashlib
+import time
+import uuid
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 from jose import jwt, JWTError
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from passlib.context import CryptContext
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import HTTPBearer, OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf import messages
 from src.conf.config import settings
 from src.database.db import get_db
+from src.models.models import User
 from src.repository import users as repository_users
+from src.services.user_cache import user_cache
+from src.services.executor import password_executor
+from src.utils.lru import LRUCache
+
+
+@dataclass
+class AuthContext:
+    """
+    The credentials of a request: the bearer token of the Authorization header, its claims or None when
+    the token is invalid or expired, and the user once a dependency resolved it.
+    It is built once per request by the middleware and stored on ``request.state.auth``.
+    """
+    token: str | None = None
+    payload: dict | None = None
+    user: User | None = None
+
+    @property
+    def expires_at(self) -> datetime | None:
+        if self.payload is None or not isinstance(self.payload.get('exp'), (int, float)):
+            return None
+        return datetime.utcfromtimestamp(self.payload['exp'])
+
+
+def get_auth_context(request: Request) -> AuthContext:
+    """
+    The get_auth_context function returns the auth context of a request, building it from the Authorization
+    header when the middleware did not run.
+
+    :param request: Request: The request
+    :return: The auth context of the request
+    :doc-author: RSA
+    """
+    context = getattr(request.state, 'auth', None)
+    if context is None:
+        context = auth_service.read_context(request.headers.get("Authorization"))
+        if context is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token is invalid")
+        request.state.auth = context
+    return context
+
+
+def require_token(request: Request) -> AuthContext:
+    context = get_auth_context(request)
+    if context.token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return context
+
+
+class OAuth2BearerContext(OAuth2PasswordBearer):
+    """
+    The OAuth2 password bearer scheme of the API docs, returning the auth context of the request
+    instead of parsing the Authorization header again.
+    """
+
+    async def __call__(self, request: Request) -> AuthContext:
+        return require_token(request)
+
+
+class HTTPBearerContext(HTTPBearer):
+    """
+    The HTTP bearer scheme of the API docs, returning the auth context of the request
+    instead of parsing the Authorization header again.
+    """
+
+    async def __call__(self, request: Request) -> AuthContext:
+        return require_token(request)
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
-    oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+    oauth2_scheme = OAuth2BearerContext(tokenUrl="/api/auth/login", scheme_name="OAuth2PasswordBearer")
+    token_cache = LRUCache(settings.jwt_cache_size)
 
     # blacklist_access_tokens = []
 
+    def decode_token(self, token: str) -> dict:
+        """
+        The decode_token function verifies a token and returns its claims.
+        The claims of verified tokens are kept in a bounded LRU cache by the digest of the token until the token
+        expires, so a token that is used again is not verified and parsed again. Invalid tokens are not cached.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The claims of the token
+        :raises JWTError: The token is invalid or expired
+        :doc-author: RSA
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self.token_cache.get(key)
+        if entry is not None:
+            payload, expires_at = entry
+            if expires_at > time.time():
+                return payload
+            self.token_cache.pop(key)
+        payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        if isinstance(payload.get('exp'), (int, float)):
+            self.token_cache.put(key, (payload, payload['exp']))
+        return payload
+
+    def read_context(self, authorization: str | None) -> AuthContext | None:
+        """
+        The read_context function parses the Authorization header of a request and decodes its bearer token.
+        A token that cannot be decoded leaves the claims empty, so it is rejected by the dependencies
+        of the protected routes only.
+
+        :param self: Represent the instance of the class
+        :param authorization: str | None: The Authorization header
+        :return: The auth context, or None when the header is not a bearer token
+        :doc-author: RSA
+        """
+        if authorization is None:
+            return AuthContext()
+        parts = authorization.split()
+        if len(parts) != 2 or parts[0].lower() != "bearer":
+            return None
+        try:
+            payload = self.decode_token(parts[1])
+        except JWTError:
+            payload = None
+        return AuthContext(token=parts[1], payload=payload)
+
     async def verify_password(self, plain_password, hashed_password) -> bool:
         """
         The verify_password function takes a plain-text password and a hashed password,
         and returns True if the two match. This is used to verify that the user's inputted
         password matches what we have stored in our database.
+        bcrypt runs in the password thread pool, so it does not block the event loop; when the pool and its queue
+        are full the request is rejected with 429.
 
         :param self: Represent the instance of the class
         :param plain_password: Store the password that is entered by the user
@@ -33,20 +154,33 @@ class Auth:
         :return: True if the plain_password matches the hashed_password, and false otherwise
         :doc-author: RSA
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await password_executor.run(self.pwd_context.verify, plain_password, hashed_password)
+
+    async def verify_and_update_password(self, plain_password, hashed_password) -> tuple[bool, str | None]:
+        """
+        The verify_and_update_password function checks a password like verify_password and, when the hash
+        was made with other settings than the current ones, e.g. another bcrypt cost, also hashes it again
+        with the current settings.
+
+        :param self: Represent the instance of the class
+        :param plain_password: The password entered by the user
+        :param hashed_password: The stored hash of the password
+        :return: Whether the password matches and the new hash to store, or None if the hash is up to date
+        :doc-author: RSA
+        """
+        return await password_executor.run(self.pwd_context.verify_and_update, plain_password, hashed_password)
 
     async def get_password_hash(self, password) -> str:
         """
         The get_password_hash function is a helper function that hashes the password using the passlib library.
-        The hashing algorithm used by this function is PBKDF2 with HMAC-SHA256, which is considered to be one
-        of the most secure algorithms available today.
+        The password is hashed with bcrypt at the cost set by ``settings.bcrypt_rounds``, in the password thread pool.
 
         :param self: Represent the instance of the class
         :param password: Hash the password
         :return: A hash of the password
         :doc-author: RSA
         """
-        return self.pwd_context.hash(password)
+        return await password_executor.run(self.pwd_context.hash, password)
 
     # function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -91,78 +225,73 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(days=30)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
+        # a unique id, so a refresh token issued in the same second as the one it replaces still differs from it
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token", "jti": uuid.uuid4().hex})
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
-    async def decode_refresh_token(self, refresh_token: str):
+    def refresh_subject(self, context: AuthContext) -> str:
         """
-        The decode_refresh_token function takes a refresh token and decodes it.
-        If the scope is 'refresh_token', then we return the email address of the user who owns that token.
-        Otherwise, we raise an HTTPException with status code 401 (UNAUTHORIZED) and detail message &quot;
-        Invalid scope for token&quot;.
-        If there's a JWTError, then we also raise an HTTPException with status code 401 (UNAUTHORIZED) and
-        detail message &quot;Could not validate credentials&quot;.
+        The refresh_subject function returns the email of the user of a refresh token already decoded
+        into the auth context of the request.
 
         :param self: Represent the instance of the class
-        :param refresh_token: str: Pass the refresh token to the function
-        :return: The email of the user who is logged in
+        :param context: AuthContext: The auth context of the request
+        :return: The email of the user
         :doc-author: RSA
         """
-        try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            print(payload)
-            if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid scope for token")
-
-        except JWTError:
+        if context.payload is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        if context.payload.get('scope') != 'refresh_token' or context.payload.get('sub') is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid scope for token")
+        return context.payload['sub']
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    async def get_current_user(self, context: AuthContext = Depends(oauth2_scheme),
+                               db: AsyncSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the protected route.
-        It takes an OAuth2 token as input and returns the user object if it's valid, or raises an exception otherwise.
+        It takes the auth context of the request and returns the user object if its token is valid,
+        or raises an exception otherwise. The token was decoded by the middleware and the user is stored
+        on the context, so dependencies that need the user again in the same request do not look it up again.
+        Active users are kept in the user cache of the worker by the subject and issue time of the token,
+        so repeated requests with the same token do not query the user.
 
         :param self: Represent the instance of a class
-        :param token: str: Get the token from the header
+        :param context: AuthContext: The auth context of the request
         :param db: AsyncSession: Get the database session
         :return: The user object
         :doc-author: RSA
         """
+        if context.user is not None:
+            return context.user
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-
-            else:
-                raise credentials_exception
-
-            email = payload["sub"]
-            if email is None:
-                raise credentials_exception
-        except JWTError as e:
+        payload = context.payload
+        if payload is None or payload.get('scope') != 'access_token':
+            raise credentials_exception
+        email = payload.get("sub")
+        if email is None:
             raise credentials_exception
 
+        issued_at = payload.get("iat")
+        user = await user_cache.get(email, issued_at, db)
+        if user is not None:
+            context.user = user
+            return user
+
+        generation = user_cache.generation(email)
         user = await repository_users.get_user_by_email(email, db)
         if user is None:
             raise credentials_exception
 
-        if user.refresh_token is None:
-            raise credentials_exception
-
         if not user.is_active:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive")
 
+        user_cache.put(email, issued_at, user, generation)
+        context.user = user
         return user
 
     async def create_email_token(self, data: dict):
@@ -193,7 +322,7 @@ class Auth:
         :doc-author: RSA
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(token)
             email = payload["sub"]
             return email
         except JWTError as e:
@@ -201,40 +330,5 @@ class Auth:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="Invalid token for email verification")
 
-    # @staticmethod
-    async def get_user_access_token(self, access_token: str = Depends(oauth2_scheme)):
-        """
-        The get_user_access_token function is a dependency that will be used by the
-        get_current_user function. It takes an access token as input and returns it.
-        The access token is provided by the oauth2_scheme dependency, which uses the OAuth2PasswordBearer scheme to validate
-        the user's credentials.
-
-        :param self: Access the class variables and methods
-        :param access_token: str: Get the access token from the request
-        :return: The access_token
-        :doc-author: RSA
-        """
-        return access_token
-
-    async def get_token_expiration_time(self, token: str):
-        """
-        The get_token_expiration_time function takes a token as an argument and returns the expiration time of that token.
-        If the token is invalid, it will return None.
-
-        :param self: Represent the instance of a class
-        :param token: str: Pass in the token that is being decoded
-        :return: The expiration time of the token
-        :doc-author: RSA
-        """
-        try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                expiration_time = datetime.utcfromtimestamp(payload['exp'])
-                return expiration_time
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid scope for token")
-
-        except JWTError:
-            return
-
 
 auth_service = Auth()
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import math
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from src.conf.config import settings
+from src.database.db import redis_client
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class BloomFilter:
+    """
+    A set of strings that answers membership with no false negatives and a small rate of false positives,
+    in a fixed amount of memory. Items cannot be removed, the filter is rebuilt instead.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BlacklistBackend(ABC):
+    """
+    Interface of the shared store of the revoked tokens. Entries are keyed by the digest of the token
+    and expire together with the token.
+    """
+
+    @abstractmethod
+    async def add(self, digest: str, ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def contains(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def digests(self) -> list[str]:
+        ...
+
+    async def listen(self, on_revoke, on_ready):
+        """
+        The listen function calls on_revoke with the digest of every token revoked by another worker, forever.
+        on_ready is awaited once the revocations are being received, so a revocation made while it runs
+        is not missed. A backend local to the process has no other workers to listen to.
+
+        :param self: Represent the instance of the class
+        :param on_revoke: Callable: Called with the digest of each revoked token
+        :param on_ready: Callable: Coroutine function awaited once listening
+        :return: None
+        :doc-author: RSA
+        """
+        await on_ready()
+        await asyncio.Event().wait()
+
+
+class RedisBlacklist(BlacklistBackend):
+    """
+    Keeps every revoked token under ``blacklist:<digest>`` with the remaining lifetime of the token as TTL,
+    and announces it on the ``blacklist`` channel so the other workers add it to their Bloom filter.
+    """
+    prefix = 'blacklist:'
+    channel = 'blacklist'
+
+    def __init__(self, client):
+        self.client = client
+
+    async def add(self, digest: str, ttl: int) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self.prefix + digest, 1, ex=ttl)
+            pipe.publish(self.channel, digest)
+            await pipe.execute()
+
+    async def contains(self, digest: str) -> bool:
+        return bool(await self.client.exists(self.prefix + digest))
+
+    async def digests(self) -> list[str]:
+        return [key.removeprefix(self.prefix) async for key in self.client.scan_iter(match=self.prefix + '*',
+                                                                                     count=1000)]
+
+    async def listen(self, on_revoke, on_ready):
+        async with self.client.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            await on_ready()
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    on_revoke(message['data'])
+
+
+class MemoryBlacklist(BlacklistBackend):
+    """
+    Keeps the revoked tokens in a dict of this process, for development and tests.
+    With several workers a token is only revoked on the worker that handled the logout.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, float] = {}
+
+    async def add(self, digest: str, ttl: int) -> None:
+        self.entries[digest] = time.monotonic() + ttl
+
+    async def contains(self, digest: str) -> bool:
+        expires_at = self.entries.get(digest)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self.entries[digest]
+            return False
+        return True
+
+    async def digests(self) -> list[str]:
+        now = time.monotonic()
+        self.entries = {digest: expires_at for digest, expires_at in self.entries.items() if expires_at > now}
+        return list(self.entries)
+
+
+class TokenBlacklist:
+    """
+    The revoked access tokens, shared by all the workers through the backend.
+    Every worker keeps a Bloom filter of the revoked tokens, so the check of a token that was not revoked,
+    which is nearly every request, is answered without leaving the process. Only the tokens the filter
+    reports, the revoked ones and rare false positives, are looked up in the backend.
+    The filter is filled at startup, kept up to date from the revocations of the other workers and rebuilt
+    every ``settings.blacklist_rebuild_interval`` seconds to drop the tokens that expired since.
+    """
+
+    def __init__(self, backend: BlacklistBackend):
+        self.backend = backend
+        self.bloom = BloomFilter(settings.blacklist_bloom_capacity, settings.blacklist_bloom_error_rate)
+        self._pending: list[list[str]] = []
+
+    async def revoke(self, token: str, expires_at: datetime | None):
+        """
+        The revoke function blacklists a token until it expires.
+
+        :param self: Represent the instance of the class
+        :param token: str: The access token
+        :param expires_at: datetime | None: Expiration time of the token in UTC, None when it is unknown
+        :return: None
+        :doc-author: RSA
+        """
+        if expires_at is None:
+            ttl = settings.blacklist_default_ttl
+        else:
+            ttl = math.ceil((expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        digest = token_digest(token)
+        self._on_revoke(digest)
+        await self.backend.add(digest, ttl)
+
+    async def is_revoked(self, token: str) -> bool:
+        """
+        The is_revoked function checks whether a token was blacklisted.
+        If the backend cannot be reached for a token the Bloom filter reports, the token is treated as revoked.
+
+        :param self: Represent the instance of the class
+        :param token: str: The access token
+        :return: True if the token was revoked
+        :doc-author: RSA
+        """
+        digest = token_digest(token)
+        if digest not in self.bloom:
+            return False
+        try:
+            return await self.backend.contains(digest)
+        except Exception as err:
+            print(err)
+            return True
+
+    async def rebuild(self):
+        """
+        The rebuild function replaces the Bloom filter with one built from the tokens still in the backend,
+        sized for at least twice their number. Tokens revoked while the backend is read are added as well.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: RSA
+        """
+        added = []
+        self._pending.append(added)
+        try:
+            digests = await self.backend.digests()
+            bloom = BloomFilter(max(settings.blacklist_bloom_capacity, 2 * len(digests)),
+                                settings.blacklist_bloom_error_rate)
+            for digest in [*digests, *added]:
+                bloom.add(digest)
+            self.bloom = bloom
+        finally:
+            self._pending.remove(added)
+
+    def _on_revoke(self, digest: str):
+        self.bloom.add(digest)
+        for added in self._pending:
+            added.append(digest)
+
+    async def run(self):
+        """
+        The run function keeps the Bloom filter of this worker up to date, forever: it adds the tokens revoked
+        by the other workers as they are announced and rebuilds the filter periodically. When the backend
+        is unavailable, the filter is rebuilt as soon as the worker listens again, so no revocation is missed.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: RSA
+        """
+        await asyncio.gather(self._listen(), self._refresh())
+
+    async def _listen(self):
+        while True:
+            try:
+                await self.backend.listen(self._on_revoke, self.rebuild)
+            except Exception as err:
+                print(err)
+            await asyncio.sleep(settings.blacklist_retry_delay)
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(settings.blacklist_rebuild_interval)
+            try:
+                await self.rebuild()
+            except Exception as err:
+                print(err)
+
+
+def create_token_blacklist(backend: str) -> TokenBlacklist:
+    """
+    The create_token_blacklist function creates the blacklist selected by the ``blacklist_backend`` setting.
+
+    :param backend: str: Either 'redis' or 'memory'
+    :return: A token blacklist
+    :doc-author: RSA
+    """
+    if backend == 'redis':
+        return TokenBlacklist(RedisBlacklist(redis_client))
+    if backend == 'memory':
+        return TokenBlacklist(MemoryBlacklist())
+    raise ValueError(f"Unknown blacklist backend: {backend}")
+
+
+token_blacklist = create_token_blacklist(settings.blacklist_backend)
@@ -0,0 +1,222 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Awaitable, Callable
+
+from fastapi import Request, Response
+
+from src.conf.config import settings
+from src.database.db import redis_client
+from src.utils.etag import etag_matches, not_modified
+
+
+class CacheBackend(ABC):
+    """
+    Interface of the key-value store behind the response cache.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int:
+        ...
+
+
+class RedisCache(CacheBackend):
+    """
+    Keeps the cached responses in Redis, so all the workers share them and see the same invalidations.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get(self, key: str) -> str | None:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self.client.set(key, value, ex=ttl)
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+
+class MemoryCache(CacheBackend):
+    """
+    Keeps the cached responses in a dict of this process. It is meant for development and tests,
+    where it stands in for Redis; with several workers each one would serve its own stale entries.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, tuple[str, float | None]] = {}
+
+    async def get(self, key: str) -> str | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        self.entries[key] = (value, time.monotonic() + ttl)
+
+    async def incr(self, key: str) -> int:
+        value = int(await self.get(key) or 0) + 1
+        self.entries[key] = (str(value), None)
+        return value
+
+
+class ResponseCache:
+    """
+    Caches the serialized responses of the image read endpoints.
+    Every key carries a version number that a change increments: a single image has its own version,
+    and the listing pages, which can contain any image, share one that every change of an image increments.
+    Entries cached under an old version are no longer read and expire with their TTL, so a response built
+    from rows read before a change and stored after it is never served.
+    Errors of the store are printed and treated as misses, so the endpoints keep working without it.
+    """
+    version_key = 'cache:images:version'
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @staticmethod
+    def image_version_key(image_id: int) -> str:
+        return f'cache:image:{image_id}:version'
+
+    async def _version(self, version_key: str) -> str | None:
+        try:
+            return str(await self.backend.get(version_key) or 0)
+        except Exception as err:
+            print(err)
+            return None
+
+    async def image_key(self, image_id: int) -> str | None:
+        """
+        The image_key function builds the key of a single image under the current version of the image.
+
+        :param self: Represent the instance of the class
+        :param image_id: int: Id of the image
+        :return: The cache key or None when the store is unavailable
+        :doc-author: RSA
+        """
+        version = await self._version(self.image_version_key(image_id))
+        if version is None:
+            return None
+        return f'cache:image:{image_id}:{version}'
+
+    async def page_key(self, name: str, *params) -> str | None:
+        """
+        The page_key function builds the key of a listing page under the current version of the listings.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the listing
+        :param params: The query parameters that select the page
+        :return: The cache key or None when the store is unavailable
+        :doc-author: RSA
+        """
+        version = await self._version(self.version_key)
+        if version is None:
+            return None
+        return f'cache:images:{version}:{name}:' + ':'.join(str(param) for param in params)
+
+    async def get(self, key: str | None, kind: str) -> str | None:
+        value = None
+        if key is not None:
+            try:
+                value = await self.backend.get(key)
+            except Exception as err:
+                print(err)
+        if value is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return value
+
+    async def set(self, key: str | None, value: str, ttl: int):
+        if key is None or ttl <= 0:
+            return
+        try:
+            await self.backend.set(key, value, ttl)
+        except Exception as err:
+            print(err)
+
+    async def fetch(self, key: str | None, kind: str, ttl: int,
+                    build: Callable[[], Awaitable[tuple[dict[str, str], str]]],
+                    request: Request | None = None) -> Response:
+        """
+        The fetch function returns the cached JSON response stored under key, or builds it with ``build``
+        and caches it for ttl seconds. Exceptions raised by build, e.g. a 404, are not cached.
+        When the ETag of the response matches the If-None-Match header of the request,
+        an empty 304 response is returned instead.
+
+        :param self: Represent the instance of the class
+        :param key: str | None: The cache key of the response
+        :param kind: str: Name of the endpoint in the hit and miss counters
+        :param ttl: int: Lifetime of the entry in seconds
+        :param build: Coroutine function returning the headers and JSON body of the response
+        :param request: Request | None: The request, to answer conditional requests
+        :return: The JSON response
+        :doc-author: RSA
+        """
+        cached = await self.get(key, kind)
+        if cached is not None:
+            headers, body = json.loads(cached)
+        else:
+            headers, body = await build()
+            await self.set(key, json.dumps([headers, body]), ttl)
+        if request is not None and 'ETag' in headers and etag_matches(request, headers['ETag']):
+            return not_modified(headers)
+        return Response(body, media_type='application/json', headers=headers)
+
+    async def invalidate(self, *image_ids: int):
+        """
+        The invalidate function drops the cached responses that may contain the given images
+        by moving them and all the listing pages to a new version.
+
+        :param self: Represent the instance of the class
+        :param image_ids: int: Ids of the changed images
+        :return: None
+        :doc-author: RSA
+        """
+        try:
+            await self.backend.incr(self.version_key)
+            for image_id in image_ids:
+                await self.backend.incr(self.image_version_key(image_id))
+        except Exception as err:
+            print(err)
+
+    def stats(self) -> dict:
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+        }
+
+
+def create_response_cache(backend: str) -> ResponseCache:
+    """
+    The create_response_cache function creates the cache selected by the ``response_cache_backend`` setting.
+
+    :param backend: str: Either 'redis' or 'memory'
+    :return: A response cache
+    :doc-author: RSA
+    """
+    if backend == 'redis':
+        return ResponseCache(RedisCache(redis_client))
+    if backend == 'memory':
+        return ResponseCache(MemoryCache())
+    raise ValueError(f"Unknown response cache backend: {backend}")
+
+
+response_cache = create_response_cache(settings.response_cache_backend)
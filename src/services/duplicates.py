@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db import sessionmanager
+from src.models.models import Image
+
+HASH_MASK = (1 << 64) - 1
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return ((a ^ b) & HASH_MASK).bit_count()
+
+
+def flips(value: int, bits: int, radius: int) -> list[int]:
+    """
+    The flips function lists all the values of ``bits`` bits within Hamming distance ``radius`` of value.
+
+    :param value: int: The value to start from
+    :param bits: int: Width of the value in bits
+    :param radius: int: The largest number of flipped bits
+    :return: The values, value itself first
+    :doc-author: RSA
+    """
+    values = [value]
+    for count in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), count):
+            flipped = value
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
+
+
+class HammingIndex:
+    """
+    A multi-index hash table of 64-bit hashes under the Hamming distance.
+    Every hash is split into CHUNKS chunks and each chunk is indexed in its own table. Two hashes within
+    distance d agree within d // CHUNKS bits on at least one chunk, so a search only probes the buckets
+    of the chunks of the query within that radius and checks the full distance of the few candidates found there,
+    instead of comparing the query with every hash.
+    """
+    chunks = 4
+    chunk_bits = 16
+
+    def __init__(self):
+        self.hashes: dict[int, int] = {}
+        self.tables: list[dict[int, set[int]]] = [{} for _ in range(self.chunks)]
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _split(self, phash: int) -> list[int]:
+        mask = (1 << self.chunk_bits) - 1
+        value = phash & HASH_MASK
+        return [(value >> (index * self.chunk_bits)) & mask for index in range(self.chunks)]
+
+    def add(self, image_id: int, phash: int):
+        self.remove(image_id)
+        self.hashes[image_id] = phash
+        for table, chunk in zip(self.tables, self._split(phash)):
+            table.setdefault(chunk, set()).add(image_id)
+
+    def remove(self, image_id: int):
+        phash = self.hashes.pop(image_id, None)
+        if phash is None:
+            return
+        for table, chunk in zip(self.tables, self._split(phash)):
+            bucket = table[chunk]
+            bucket.discard(image_id)
+            if not bucket:
+                del table[chunk]
+
+    def search(self, phash: int, max_distance: int) -> list[tuple[int, int]]:
+        """
+        The search function finds the images whose hash is within max_distance of the given hash.
+
+        :param self: Represent the instance of the class
+        :param phash: int: The hash to look for
+        :param max_distance: int: The largest Hamming distance to report
+        :return: A list of (distance, image_id) pairs, nearest first
+        :doc-author: RSA
+        """
+        radius = max_distance // self.chunks
+        candidates = set()
+        for table, chunk in zip(self.tables, self._split(phash)):
+            for value in flips(chunk, self.chunk_bits, radius):
+                bucket = table.get(value)
+                if bucket:
+                    candidates |= bucket
+        found = []
+        for image_id in candidates:
+            distance = hamming_distance(phash, self.hashes[image_id])
+            if distance <= max_distance:
+                found.append((distance, image_id))
+        found.sort()
+        return found
+
+
+class DuplicateIndex:
+    """
+    The in-memory index of the perceptual hashes of all images of one worker.
+    It is built from the database at startup and updated when this worker creates or deletes an image.
+    Images created by other workers are picked up before each search by loading the rows with a higher id
+    than the last one seen; images they deleted are filtered out when the found images are loaded.
+    """
+
+    def __init__(self):
+        self.hashes = HammingIndex()
+        self.last_id = 0
+        self._lock = asyncio.Lock()
+
+    def add(self, image_id: int, phash: int | None):
+        if phash is not None:
+            self.hashes.add(image_id, phash)
+
+    def remove(self, image_id: int):
+        self.hashes.remove(image_id)
+
+    async def sync(self, db: AsyncSession):
+        """
+        The sync function adds the hashes of the images created since the last sync, or all of them on first use.
+        The rows are streamed in id order, so a full rebuild does not hold the whole table in memory.
+
+        :param self: Represent the instance of the class
+        :param db: AsyncSession: Get the database session
+        :return: None
+        :doc-author: RSA
+        """
+        async with self._lock:
+            query = (select(Image.id, Image.phash)
+                     .where(Image.id > self.last_id, Image.phash.is_not(None))
+                     .order_by(Image.id)
+                     .execution_options(yield_per=10000))
+            rows = await db.stream(query)
+            async for image_id, phash in rows:
+                self.add(image_id, phash)
+                self.last_id = image_id
+
+    async def rebuild(self):
+        try:
+            async with sessionmanager.session() as db:
+                await self.sync(db)
+        except Exception as err:
+            print(err)
+
+    async def search(self, phash: int, max_distance: int, db: AsyncSession) -> list[tuple[int, int]]:
+        await self.sync(db)
+        return self.hashes.search(phash, max_distance)
+
+
+duplicate_index = DuplicateIndex()
@@ -0,0 +1,78 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+
+
+class BoundedExecutor:
+    """
+    Runs blocking calls in a thread pool, or a process pool for CPU bound work, so they do not freeze the event loop.
+    At most ``max_workers`` calls run at the same time and at most ``max_queue`` more wait for a free worker;
+    any call beyond that is rejected right away with ``overflow_status``.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int,
+                 overflow_status: int = status.HTTP_503_SERVICE_UNAVAILABLE,
+                 overflow_detail: str = "Service is busy. Try again later",
+                 processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.overflow_status = overflow_status
+        self.overflow_detail = overflow_detail
+        self.processes = processes
+        self._pending = 0
+        self._executor: Executor | None = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        return max(self._pending - self.max_workers, 0)
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """
+        The run function executes a blocking callable in the pool and awaits its result.
+
+        :param self: Represent the instance of the class
+        :param func: Callable: The blocking function to call, a module level function when running in processes
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :return: The result of the function
+        :doc-author: RSA
+        """
+        if self._pending >= self.max_workers + self.max_queue:
+            raise HTTPException(status_code=self.overflow_status, detail=self.overflow_detail,
+                                headers={"Retry-After": "1"})
+        if self._executor is None:
+            if self.processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+storage_executor = BoundedExecutor("storage", settings.storage_max_workers, settings.storage_max_queue,
+                                   overflow_detail="Image storage is busy. Try again later")
+image_executor = BoundedExecutor("imaging", settings.image_workers, settings.image_max_queue,
+                                 overflow_detail="Image processing is busy. Try again later", processes=True)
+# bcrypt releases the GIL while hashing, so threads are enough to keep it off the event loop
+password_executor = BoundedExecutor("password", settings.password_workers, settings.password_max_queue,
+                                    overflow_status=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    overflow_detail="Too many login attempts. Try again later")
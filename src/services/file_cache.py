@@ -0,0 +1,186 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from src.conf.config import settings
+from src.models.models import Image
+from src.services.storage import ObjectStream
+
+
+class DiskCache:
+    """
+    A read-through cache of downloaded files on the local disk, shared by all the processes using the directory.
+    The files are the index: a hit touches the modification time of its file, and after every fill the directory
+    is scanned under a file lock and the least recently used files are evicted until their total size is within
+    ``max_bytes``. Files used in the last ``in_use_seconds`` are kept, as another process may be sending them,
+    so the directory can exceed ``max_bytes`` by the files in use.
+    Fills are written to a temporary file and renamed into place, and concurrent misses of the same key
+    in a process share a single fill, so a burst of requests for a cold image causes one origin fetch.
+    """
+    lock_name = '.lock'
+
+    def __init__(self, root: str, max_bytes: int, in_use_seconds: int = 60):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.in_use_seconds = in_use_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(image: Image) -> str:
+        """
+        The key function builds the cache key of an image from its id and content version.
+        The content digest is the version when the image has one, otherwise a hash of its storage path.
+
+        :param image: Image: The image to cache
+        :return: The cache key
+        :doc-author: RSA
+        """
+        version = image.digest or hashlib.sha1(image.path.encode()).hexdigest()
+        return f'{image.id}-{version}'
+
+    def stats(self) -> dict:
+        files = self._scan()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": len(files),
+            "size": sum(size for _, size, _ in files),
+            "max_size": self.max_bytes,
+        }
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entry_stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(entry_stat.st_mode):
+                files.append((entry_stat.st_mtime, entry_stat.st_size, entry.name))
+        return files
+
+    def get(self, key: str) -> Path | None:
+        """
+        The get function returns the path of a cached file and marks it as recently used.
+
+        :param self: Represent the instance of the class
+        :param key: str: The cache key
+        :return: The path of the cached file or None on a miss
+        :doc-author: RSA
+        """
+        path = self.root / key
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    async def fetch(self, key: str, open_origin: Callable[[], Awaitable[ObjectStream]]) -> Path | ObjectStream | None:
+        """
+        The fetch function returns the cached file for the key, filling it from the origin on a miss.
+        Only the first miss opens the origin; concurrent misses of the same key wait for that fill.
+        The fill is shielded, so a waiter that goes away does not cancel it for the others.
+        An object whose Content-Length is larger than the cache is not stored: the opened origin stream
+        is returned to the first miss, which passes it through, and the other misses get None.
+
+        :param self: Represent the instance of the class
+        :param key: str: The cache key
+        :param open_origin: Callable[[], Awaitable[ObjectStream]]: Opens the whole object at the origin
+        :return: The path of the cached file, the origin stream of an object larger than the cache,
+            or None when the caller has to read the object from the origin itself
+        :doc-author: RSA
+        """
+        path = self.get(key)
+        if path is not None:
+            self.hits += 1
+            return path
+        task = self._inflight.get(key)
+        owner = task is None
+        if owner:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fill(key, open_origin))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if owner:
+                task.add_done_callback(_close_unclaimed)
+            raise
+        if isinstance(result, ObjectStream) and not owner:
+            return None
+        return result
+
+    async def _fill(self, key: str, open_origin: Callable[[], Awaitable[ObjectStream]]) -> Path | ObjectStream | None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.fill-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                origin = await open_origin()
+                if origin.content_length is not None and origin.content_length > self.max_bytes:
+                    os.unlink(tmp_path)
+                    return origin
+                async for chunk in origin.body():
+                    tmp.write(chunk)
+                size = tmp.tell()
+            if size > self.max_bytes:
+                # Without a Content-Length the size is only known once the object is read
+                os.unlink(tmp_path)
+                return None
+            await asyncio.to_thread(self._commit, tmp_path, key)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return self.root / key
+
+    def _commit(self, tmp_path: str, key: str):
+        with open(self.root / self.lock_name, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            os.replace(tmp_path, self.root / key)
+            self._evict()
+
+    def _evict(self):
+        files = self._scan()
+        size = sum(file_size for _, file_size, _ in files)
+        in_use = time.time() - self.in_use_seconds
+        for mtime, file_size, name in sorted(files):
+            if size <= self.max_bytes or mtime > in_use:
+                break
+            try:
+                os.unlink(self.root / name)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            self.evictions += 1
+
+
+def _close_unclaimed(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is None and isinstance(task.result(), ObjectStream):
+        asyncio.ensure_future(task.result().aclose())
+
+
+download_cache = DiskCache(settings.download_cache_dir, settings.download_cache_max_bytes)
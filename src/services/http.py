@@ -0,0 +1,32 @@
+import httpx
+
+from src.conf.config import settings
+
+
+class HttpClient:
+    """
+    A single pooled async HTTP client shared by the whole worker, so outbound requests reuse keep-alive connections
+    instead of opening a new TLS connection each time.
+    """
+
+    def __init__(self):
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=settings.http_max_connections,
+                                    max_keepalive_connections=settings.http_max_keepalive_connections),
+                timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+http_client = HttpClient()
@@ -0,0 +1,134 @@
+from datetime import datetime
+from io import BytesIO
+from typing import BinaryIO
+
+import qrcode
+import qrcode.image.svg
+from PIL import Image, ImageOps, ExifTags
+
+# Pillow format names of the variant formats
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+QR_CODE_MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# Bytes from the start of a file passed to read_metadata, enough for the headers and EXIF block of common formats
+METADATA_HEAD_SIZE = 256 * 1024
+EXIF_DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S'
+# Side of the grid of the perceptual hash, 8 gives a 64-bit hash
+PHASH_SIZE = 8
+
+
+def render_variants(data: bytes, widths: list[int], formats: list[str], quality: int) -> dict[str, bytes]:
+    """
+    The render_variants function resizes an image to each of the given widths and encodes it in each of the formats.
+    The aspect ratio is kept, images are never upscaled and the EXIF orientation is applied.
+    The widths at or above the width of the original collapse into one variant of the original width,
+    so every key names the real width of its variant and no copy is rendered twice.
+    It runs in the image process pool, so it only takes and returns plain bytes.
+
+    :param data: bytes: Content of the original image
+    :param widths: list[int]: Widths of the variants in pixels
+    :param formats: list[str]: Formats of the variants, keys of VARIANT_FORMATS
+    :param quality: int: Encoder quality of the variants
+    :return: A dictionary with the encoded variants keyed by '<width>_<format>'
+    :doc-author: RSA
+    """
+    variants = {}
+    with Image.open(BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+        for target in sorted({min(width, original.width) for width in widths}):
+            height = max(round(original.height * target / original.width), 1)
+            resized = original.resize((target, height), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                image = resized.convert('RGB') if fmt == 'jpeg' and resized.mode != 'RGB' else resized
+                buffer = BytesIO()
+                image.save(buffer, format=VARIANT_FORMATS[fmt], quality=quality, optimize=True)
+                variants[f'{target}_{fmt}'] = buffer.getvalue()
+    return variants
+
+
+def read_metadata(head: bytes) -> dict:
+    """
+    The read_metadata function reads the dimensions, format, EXIF orientation and capture time of an image.
+    Only the headers are parsed, the pixel data is never decoded, so the first METADATA_HEAD_SIZE bytes are enough.
+    Width and height are the displayed ones, i.e. swapped when the orientation rotates the image by 90 degrees.
+    It runs in the image process pool, so it only takes bytes and returns plain values.
+
+    :param head: bytes: The first bytes of the image
+    :return: A dictionary with the width, height, format, orientation and taken_at keys
+    :doc-author: RSA
+    """
+    with Image.open(BytesIO(head)) as image:
+        width, height = image.size
+        fmt = image.format.lower() if image.format else None
+        exif = Image.Exif()
+        if 'exif' in image.info:
+            exif.load(image.info['exif'])
+        elif image.format == 'TIFF':
+            exif = image.getexif()
+    orientation = exif.get(ExifTags.Base.Orientation)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    taken = exif.get_ifd(ExifTags.IFD.Exif).get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+    try:
+        taken_at = datetime.strptime(str(taken).strip('\x00 '), EXIF_DATETIME_FORMAT) if taken else None
+    except ValueError:
+        taken_at = None
+    return {
+        'width': width,
+        'height': height,
+        'format': fmt,
+        'orientation': orientation if isinstance(orientation, int) else None,
+        'taken_at': taken_at,
+    }
+
+
+def perceptual_hash(source: BinaryIO) -> int:
+    """
+    The perceptual_hash function computes the 64-bit difference hash (dHash) of an image.
+    The image is reduced to a 9x8 grayscale grid and every bit tells whether a pixel is brighter than its right
+    neighbour, so resized or recompressed copies of a photo get hashes within a small Hamming distance.
+    JPEGs are decoded at a reduced scale, which makes hashing a large photo cheap.
+    The image is read from the file object as it is decoded, the content is never loaded into memory as a whole.
+    The hash is returned as a signed 64-bit integer, so it fits a BIGINT column.
+
+    :param source: BinaryIO: The image file, read from its current position
+    :return: The hash of the image
+    :doc-author: RSA
+    """
+    with Image.open(source) as original:
+        original.draft('L', (PHASH_SIZE * 8, PHASH_SIZE * 8))
+        image = ImageOps.exif_transpose(original).convert('L')
+        image = image.resize((PHASH_SIZE + 1, PHASH_SIZE), Image.Resampling.BOX)
+    pixels = image.tobytes()
+    value = 0
+    for row in range(PHASH_SIZE):
+        for col in range(PHASH_SIZE):
+            offset = row * (PHASH_SIZE + 1) + col
+            value = value << 1 | (pixels[offset] > pixels[offset + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def render_qr_code(data: str, fmt: str = 'png') -> bytes:
+    """
+    The render_qr_code function encodes data as a QR code image in memory.
+
+    :param data: str: The data that is to be encoded in the qr code
+    :param fmt: str: Format of the image, 'png' or 'svg'
+    :return: The encoded image
+    :doc-author: RSA
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if fmt == 'svg':
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
@@ -0,0 +1,126 @@
+from io import BytesIO
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.models.models import ImageBlob
+from src.repository import images as repository_images
+from src.services.executor import image_executor
+from src.services.imaging import render_variants, read_metadata, perceptual_hash
+from src.services.storage import storage_service
+from src.services.upload import SpooledUpload
+
+
+async def store_upload(upload: SpooledUpload, db: AsyncSession) -> ImageBlob:
+    """
+    The store_upload function stores the content of an upload once per digest.
+    If a blob with the same SHA-256 digest already exists, it takes a new reference to it
+    and the storage round trip is skipped. Otherwise the file is uploaded under a fresh name and a new blob is recorded.
+
+    :param upload: SpooledUpload: The checked upload
+    :param db: AsyncSession: Get the database session
+    :return: The blob that holds the content of the upload
+    :doc-author: RSA
+    """
+    blob = await repository_images.acquire_blob(upload.digest, db)
+    if blob is not None:
+        return blob
+    new_name = await repository_images.format_filename()
+    stored = await storage_service.upload(upload.file, new_name)
+    blob = await repository_images.create_blob(upload.digest, stored.name, stored.url, upload.size, db)
+    if blob.name != stored.name:
+        # A concurrent upload of the same content won the race, our copy is not referenced
+        await storage_service.delete(stored.name)
+    return blob
+
+
+async def release_uploads(blobs: list[ImageBlob]):
+    """
+    The release_uploads function undoes store_upload for uploads whose images could not be saved:
+    it drops the references taken on their blobs and deletes the stored files that no image uses anymore.
+    It runs in its own session, as the session of the failed insert may be unusable. Failures are only logged.
+
+    :param blobs: list[ImageBlob]: The blobs returned by store_upload, once per upload
+    :return: None
+    :doc-author: RSA
+    """
+    try:
+        async with sessionmanager.session() as db:
+            orphan_paths = await repository_images.release_blobs([blob.digest for blob in blobs], db)
+    except Exception as err:
+        print(err)
+        return
+    for orphan_path in orphan_paths:
+        try:
+            await storage_service.delete(storage_service.name_from_url(orphan_path))
+        except Exception as err:
+            print(err)
+
+
+def read_spooled(upload: SpooledUpload) -> bytes:
+    try:
+        upload.file.seek(0)
+        return upload.file.read()
+    finally:
+        upload.file.seek(0)
+
+
+async def read_upload_metadata(upload: SpooledUpload) -> dict:
+    """
+    The read_upload_metadata function reads the dimensions, format, orientation and capture time of an upload
+    from the head of the file, and its perceptual hash from the whole content, both in the image process pool.
+    The process pool cannot read the spooled file, so the content is sent to it; the queue of the pool bounds
+    how many uploads are held in memory for hashing at once.
+    Each is read on its own: an image whose headers Pillow cannot parse from the head still gets its hash
+    for the duplicate index, and an image Pillow cannot parse at all is still accepted, just without metadata.
+
+    :param upload: SpooledUpload: The checked upload
+    :return: A dictionary with the width, height, format, orientation, taken_at and phash keys that could be read
+    :doc-author: RSA
+    """
+    metadata = {}
+    try:
+        metadata = await image_executor.run(read_metadata, upload.head)
+    except HTTPException:
+        raise
+    except Exception as err:
+        print(err)
+    try:
+        metadata['phash'] = await image_executor.run(perceptual_hash, BytesIO(read_spooled(upload)))
+    except HTTPException:
+        raise
+    except Exception as err:
+        print(err)
+    return metadata
+
+
+async def generate_variants(blob_id: int):
+    """
+    The generate_variants function renders the resized variants of a stored blob and saves their URLs on the blob.
+    It is run as a background task after the upload response has been sent: the original is read back
+    from the storage, resized in the image process pool and each variant is stored next to the original.
+    Failures are only logged, the image stays usable without variants.
+
+    :param blob_id: int: Id of the blob to render the variants for
+    :return: None
+    :doc-author: RSA
+    """
+    async with sessionmanager.session() as db:
+        blob = await repository_images.get_blob(blob_id, db)
+        if blob is None or blob.variants:
+            return
+        try:
+            stream = await storage_service.open_stream(blob.name)
+            data = b''.join([chunk async for chunk in stream.body()])
+            rendered = await image_executor.run(render_variants, data, settings.image_variant_widths,
+                                                settings.image_variant_formats, settings.image_variant_quality)
+            variants = {}
+            for key, content in rendered.items():
+                stored = await storage_service.upload(BytesIO(content), f'{blob.name}_{key}')
+                variants[key] = stored.url
+        except Exception as err:
+            print(err)
+            return
+        await repository_images.update_blob_variants(blob, variants, db)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from redis.exceptions import WatchError
+
+from src.conf.config import settings
+from src.database.db import redis_client
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a job handler when running the job again cannot succeed, so the job fails without retries.
+    """
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: dict
+    status: str = QUEUED
+    attempts: int = 0
+    result: dict | None = None
+    error: str | None = None
+    # When a queued job is due, or when the lease of a running job expires
+    run_at: float = field(default_factory=time.time)
+
+    def lease(self):
+        self.status = RUNNING
+        self.attempts += 1
+        self.run_at = time.time() + settings.job_lease_timeout
+
+    def expire_lease(self):
+        """
+        The expire_lease function puts back a running job whose worker did not finish it in time,
+        e.g. because its process died: it is queued again, or failed if it has no attempts left.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: RSA
+        """
+        self.error = "The worker did not finish the job in time"
+        if self.attempts < settings.job_max_attempts:
+            self.status, self.run_at = QUEUED, time.time()
+        else:
+            self.status = FAILED
+
+
+class JobQueue(ABC):
+    """
+    Interface of the background job queue. A job is claimed by one worker at a time;
+    a failed job goes back to the queue after an exponential back-off until it runs out of attempts.
+    A claimed job is leased for ``settings.job_lease_timeout`` seconds: a job still running when its lease
+    expires, because its worker died or was redeployed, is taken back by the next claim.
+    """
+
+    async def enqueue(self, kind: str, payload: dict) -> Job:
+        """
+        The enqueue function adds a new job to the queue.
+
+        :param self: Represent the instance of the class
+        :param kind: str: Name of the handler that runs the job
+        :param payload: dict: JSON serializable arguments of the handler
+        :return: The queued job
+        :doc-author: RSA
+        """
+        job = Job(id=uuid4().hex, kind=kind, payload=payload)
+        await self.save(job)
+        return job
+
+    async def complete(self, job: Job, result: dict):
+        job.status, job.result, job.error = DONE, result, None
+        await self.save(job)
+
+    async def fail(self, job: Job, error: str, retry: bool):
+        """
+        The fail function records a failed attempt of a job.
+        A job to retry is queued again to run after ``settings.job_retry_delay`` seconds,
+        doubled for every attempt already made.
+
+        :param self: Represent the instance of the class
+        :param job: Job: The failed job
+        :param error: str: Description of the failure
+        :param retry: bool: Whether to run the job again
+        :return: None
+        :doc-author: RSA
+        """
+        job.error = error
+        if retry:
+            job.status = QUEUED
+            job.run_at = time.time() + settings.job_retry_delay * 2 ** (job.attempts - 1)
+        else:
+            job.status = FAILED
+        await self.save(job)
+
+    @abstractmethod
+    async def save(self, job: Job) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Job | None:
+        ...
+
+    @abstractmethod
+    async def claim(self) -> Job | None:
+        ...
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Keeps every job as a JSON string under ``job:<id>``, the ids of the queued jobs in a sorted set scored
+    by the time they are due and the ids of the running jobs in a sorted set scored by the end of their lease.
+    A job is written together with its membership in the two sets, in one transaction.
+    Finished jobs expire after ``settings.job_result_ttl`` seconds.
+    """
+    queue_key = 'jobs:queued'
+    running_key = 'jobs:running'
+
+    def __init__(self, client):
+        self.client = client
+
+    def _write(self, pipe, job: Job):
+        ttl = settings.job_result_ttl if job.status in (DONE, FAILED) else None
+        pipe.set(f'job:{job.id}', json.dumps(asdict(job)), ex=ttl)
+        if job.status == QUEUED:
+            pipe.zadd(self.queue_key, {job.id: job.run_at})
+        else:
+            pipe.zrem(self.queue_key, job.id)
+        if job.status == RUNNING:
+            pipe.zadd(self.running_key, {job.id: job.run_at})
+        else:
+            pipe.zrem(self.running_key, job.id)
+
+    async def save(self, job: Job) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._write(pipe, job)
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> Job | None:
+        data = await self.client.get(f'job:{job_id}')
+        return Job(**json.loads(data)) if data else None
+
+    async def _take(self, job_id: str, status: str, change: Callable[[Job], None]) -> Job | None:
+        """
+        The _take function changes a due job of the given status and writes it back with its sets in one
+        MULTI/EXEC transaction that watches the job. Of the workers taking the same job only the first one
+        succeeds, and a worker that dies before EXEC leaves the job where it was.
+
+        :param self: Represent the instance of the class
+        :param job_id: str: Id of the job, read from one of the sets
+        :param status: str: The status the job must still have
+        :param change: Callable[[Job], None]: Changes the job, e.g. Job.lease
+        :return: The changed job or None if it was taken by another worker or is not due
+        :doc-author: RSA
+        """
+        key = f'job:{job_id}'
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                data = await pipe.get(key)
+                if data is None:
+                    # The job expired, drop its id from the sets
+                    await pipe.zrem(self.queue_key, job_id)
+                    await pipe.zrem(self.running_key, job_id)
+                    return None
+                job = Job(**json.loads(data))
+                if job.status != status or job.run_at > time.time():
+                    return None
+                change(job)
+                pipe.multi()
+                self._write(pipe, job)
+                await pipe.execute()
+                return job
+            except WatchError:
+                return None
+
+    async def claim(self) -> Job | None:
+        """
+        The claim function takes the first due job from the queue and leases it.
+        The running jobs whose lease expired are queued again first.
+        Every job is moved between the sets and written with its new state in one transaction,
+        so a job is never lost between the sets when a worker dies.
+
+        :param self: Represent the instance of the class
+        :return: The claimed job or None if no job is due
+        :doc-author: RSA
+        """
+        for job_id in await self.client.zrangebyscore(self.running_key, '-inf', time.time(), start=0, num=5):
+            await self._take(job_id, RUNNING, Job.expire_lease)
+        for job_id in await self.client.zrangebyscore(self.queue_key, '-inf', time.time(), start=0, num=5):
+            job = await self._take(job_id, QUEUED, Job.lease)
+            if job is not None:
+                return job
+        return None
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Keeps the jobs in a SQLite database, so the queue works without Redis, e.g. in development and tests.
+    The database file can be shared by the application and worker processes on one host.
+    The statements are short single-row writes and run directly on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+                             'payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, '
+                             'result TEXT, error TEXT, run_at REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at)')
+        return self._db
+
+    @staticmethod
+    def _job(row: sqlite3.Row | None) -> Job | None:
+        if row is None:
+            return None
+        return Job(id=row['id'], kind=row['kind'], payload=json.loads(row['payload']), status=row['status'],
+                   attempts=row['attempts'], result=json.loads(row['result']) if row['result'] else None,
+                   error=row['error'], run_at=row['run_at'])
+
+    async def save(self, job: Job) -> None:
+        self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (job.id, job.kind, json.dumps(job.payload), job.status, job.attempts,
+                         json.dumps(job.result) if job.result is not None else None, job.error, job.run_at))
+        if job.status in (DONE, FAILED):
+            self.db.execute('DELETE FROM jobs WHERE status IN (?, ?) AND run_at < ?',
+                            (DONE, FAILED, time.time() - settings.job_result_ttl))
+
+    async def get(self, job_id: str) -> Job | None:
+        return self._job(self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    async def claim(self) -> Job | None:
+        """
+        The claim function takes the first due job from the queue and leases it in a single statement,
+        so two workers never get the same job. A running job whose lease expired is taken like a due one,
+        unless it has no attempts left, then it is failed.
+
+        :param self: Represent the instance of the class
+        :return: The claimed job or None if no job is due
+        :doc-author: RSA
+        """
+        now = time.time()
+        self.db.execute('UPDATE jobs SET status = ?, error = ? WHERE status = ? AND run_at <= ? AND attempts >= ?',
+                        (FAILED, "The worker did not finish the job in time", RUNNING, now,
+                         settings.job_max_attempts))
+        row = self.db.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, run_at = ? WHERE id = '
+                              '(SELECT id FROM jobs WHERE status IN (?, ?) AND run_at <= ? ORDER BY run_at LIMIT 1) '
+                              'RETURNING *', (RUNNING, now + settings.job_lease_timeout, QUEUED, RUNNING,
+                                              now)).fetchone()
+        return self._job(row)
+
+
+async def run_worker(queue: JobQueue, handlers: dict[str, Callable[[dict], Awaitable[dict]]]):
+    """
+    The run_worker function claims jobs from the queue and runs them with the handler of their kind, forever.
+    A job that raises is retried until it has been attempted ``settings.job_max_attempts`` times,
+    except for a PermanentJobError, which fails it right away.
+
+    :param queue: JobQueue: The queue to take the jobs from
+    :param handlers: dict: Async handlers by job kind, called with the payload and returning the result
+    :return: None
+    :doc-author: RSA
+    """
+    while True:
+        try:
+            job = await queue.claim()
+            if job is None:
+                await asyncio.sleep(settings.job_poll_interval)
+                continue
+            try:
+                result = await handlers[job.kind](job.payload)
+            except PermanentJobError as err:
+                await queue.fail(job, str(err), retry=False)
+            except Exception as err:
+                print(err)
+                await queue.fail(job, str(err) or type(err).__name__, retry=job.attempts < settings.job_max_attempts)
+            else:
+                await queue.complete(job, result)
+        except Exception as err:
+            # The queue itself is unavailable, wait before polling it again
+            print(err)
+            await asyncio.sleep(settings.job_poll_interval)
+
+
+def create_job_queue(backend: str) -> JobQueue:
+    """
+    The create_job_queue function creates the queue selected by the ``job_queue_backend`` setting.
+
+    :param backend: str: Either 'redis' or 'sqlite'
+    :return: A job queue
+    :doc-author: RSA
+    """
+    if backend == 'redis':
+        return RedisJobQueue(redis_client)
+    if backend == 'sqlite':
+        return SqliteJobQueue(settings.job_queue_sqlite_path)
+    raise ValueError(f"Unknown job queue backend: {backend}")
+
+
+job_queue = create_job_queue(settings.job_queue_backend)
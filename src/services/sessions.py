@@ -0,0 +1,237 @@
+import hashlib
+import secrets
+import time
+from abc import ABC, abstractmethod
+
+from src.conf.config import settings
+from src.database.db import redis_client
+
+ROTATED = 1
+UNKNOWN = 0
+REUSED = -1
+
+
+def refresh_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionBackend(ABC):
+    """
+    Interface of the store of the login sessions. A session is one device of a user, keyed by its session id,
+    and holds the digest of the only refresh token of the session that is still valid.
+    """
+
+    @abstractmethod
+    async def create(self, sid: str, email: str, digest: str, device: str, ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def rotate(self, sid: str, email: str, digest: str, new_digest: str, ttl: int) -> int:
+        """
+        The rotate function replaces the refresh token of a session if digest is the current one.
+        A refresh token that was already rotated away means it leaked, so the session is deleted.
+
+        :param self: Represent the instance of the class
+        :param sid: str: The session id
+        :param email: str: The email of the user of the session
+        :param digest: str: Digest of the refresh token presented by the client
+        :param new_digest: str: Digest of the refresh token that replaces it
+        :param ttl: int: The new lifetime of the session in seconds
+        :return: ROTATED, UNKNOWN when there is no such session or REUSED
+        :doc-author: RSA
+        """
+        ...
+
+    @abstractmethod
+    async def delete(self, sid: str, email: str) -> None:
+        ...
+
+    @abstractmethod
+    async def delete_user(self, email: str) -> None:
+        ...
+
+
+class RedisSessions(SessionBackend):
+    """
+    Keeps every session in a hash under ``session:{<email>}:<sid>`` that expires with its refresh token,
+    and the ids of the sessions of a user in the set ``sessions:{<email>}``. The email is the hash tag of both
+    keys, so the sessions of a user are in one slot of a Redis Cluster.
+    The refresh token is compared and replaced by a script, so concurrent refreshes with the same token
+    cannot both succeed.
+    """
+    prefix = 'session:'
+    user_prefix = 'sessions:'
+    rotate_script = """
+        local digest = redis.call('HGET', KEYS[1], 'digest')
+        if not digest then
+            redis.call('SREM', KEYS[2], ARGV[4])
+            return 0
+        end
+        if digest ~= ARGV[1] then
+            redis.call('DEL', KEYS[1])
+            redis.call('SREM', KEYS[2], ARGV[4])
+            return -1
+        end
+        redis.call('HSET', KEYS[1], 'digest', ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        redis.call('EXPIRE', KEYS[2], ARGV[3])
+        return 1
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._rotate = client.register_script(self.rotate_script)
+
+    def session_key(self, sid: str, email: str) -> str:
+        return f'{self.prefix}{{{email}}}:{sid}'
+
+    def user_key(self, email: str) -> str:
+        return f'{self.user_prefix}{{{email}}}'
+
+    async def create(self, sid: str, email: str, digest: str, device: str, ttl: int) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.session_key(sid, email), mapping={'email': email, 'digest': digest, 'device': device,
+                                                             'created_at': int(time.time())})
+            pipe.expire(self.session_key(sid, email), ttl)
+            pipe.sadd(self.user_key(email), sid)
+            pipe.expire(self.user_key(email), ttl)
+            await pipe.execute()
+
+    async def rotate(self, sid: str, email: str, digest: str, new_digest: str, ttl: int) -> int:
+        result = await self._rotate(keys=[self.session_key(sid, email), self.user_key(email)],
+                                    args=[digest, new_digest, ttl, sid])
+        return int(result)
+
+    async def delete(self, sid: str, email: str) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.session_key(sid, email))
+            pipe.srem(self.user_key(email), sid)
+            await pipe.execute()
+
+    async def delete_user(self, email: str) -> None:
+        sids = await self.client.smembers(self.user_key(email))
+        await self.client.delete(self.user_key(email), *(self.session_key(sid, email) for sid in sids))
+
+
+class MemorySessions(SessionBackend):
+    """
+    Keeps the sessions in a dict of this process, for development and tests.
+    With several workers a session is only known to the worker that handled the login.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, dict] = {}
+        self.users: dict[str, set[str]] = {}
+
+    def _get(self, sid: str, email: str) -> dict | None:
+        entry = self.entries.get(sid)
+        if entry is not None and entry['expires_at'] <= time.monotonic():
+            self._remove(sid, email)
+            return None
+        return entry if entry is not None and entry['email'] == email else None
+
+    def _remove(self, sid: str, email: str):
+        entry = self.entries.get(sid)
+        if entry is not None and entry['email'] == email:
+            del self.entries[sid]
+        sids = self.users.get(email)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.users[email]
+
+    async def create(self, sid: str, email: str, digest: str, device: str, ttl: int) -> None:
+        self.entries[sid] = {'email': email, 'digest': digest, 'device': device,
+                             'expires_at': time.monotonic() + ttl}
+        self.users.setdefault(email, set()).add(sid)
+
+    async def rotate(self, sid: str, email: str, digest: str, new_digest: str, ttl: int) -> int:
+        entry = self._get(sid, email)
+        if entry is None:
+            self._remove(sid, email)
+            return UNKNOWN
+        if not secrets.compare_digest(entry['digest'], digest):
+            self._remove(sid, email)
+            return REUSED
+        entry.update(digest=new_digest, expires_at=time.monotonic() + ttl)
+        return ROTATED
+
+    async def delete(self, sid: str, email: str) -> None:
+        self._remove(sid, email)
+
+    async def delete_user(self, email: str) -> None:
+        for sid in self.users.pop(email, set()):
+            self.entries.pop(sid, None)
+
+
+class SessionStore:
+    """
+    The login sessions of the users, one per device, so a user can stay logged in on several devices.
+    Each refresh token carries the id of its session and can be used once: refreshing replaces it with
+    a new one. When a replaced refresh token is presented again, someone else holds a copy of it,
+    and the session is ended for both. Only digests of the refresh tokens are stored.
+    """
+
+    def __init__(self, backend: SessionBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def new_sid() -> str:
+        return secrets.token_urlsafe(16)
+
+    async def open(self, sid: str, email: str, refresh_token: str, device: str | None = None):
+        """
+        The open function starts a session with its first refresh token.
+
+        :param self: Represent the instance of the class
+        :param sid: str: The session id, made by new_sid and put in the tokens of the session
+        :param email: str: The email of the user
+        :param refresh_token: str: The refresh token of the session
+        :param device: str | None: Description of the client, e.g. its User-Agent
+        :return: None
+        :doc-author: RSA
+        """
+        await self.backend.create(sid, email, refresh_digest(refresh_token), (device or '')[:255], self.ttl)
+
+    async def rotate(self, sid: str, email: str, refresh_token: str, new_refresh_token: str) -> bool:
+        """
+        The rotate function replaces the refresh token of a session with a new one.
+
+        :param self: Represent the instance of the class
+        :param sid: str: The session id of the refresh token
+        :param email: str: The email of the user, the subject of the refresh token
+        :param refresh_token: str: The refresh token presented by the client
+        :param new_refresh_token: str: The refresh token that replaces it
+        :return: False when the session does not exist, e.g. after a logout, or the refresh token was reused
+        :doc-author: RSA
+        """
+        result = await self.backend.rotate(sid, email, refresh_digest(refresh_token),
+                                           refresh_digest(new_refresh_token), self.ttl)
+        if result == REUSED:
+            print(f"Refresh token of session {sid} was reused, the session is revoked")
+        return result == ROTATED
+
+    async def close(self, sid: str, email: str):
+        await self.backend.delete(sid, email)
+
+    async def close_all(self, email: str):
+        await self.backend.delete_user(email)
+
+
+def create_session_store(backend: str) -> SessionStore:
+    """
+    The create_session_store function creates the session store selected by the ``session_backend`` setting.
+
+    :param backend: str: Either 'redis' or 'memory'
+    :return: A session store
+    :doc-author: RSA
+    """
+    if backend == 'redis':
+        return SessionStore(RedisSessions(redis_client), settings.session_ttl)
+    if backend == 'memory':
+        return SessionStore(MemorySessions(), settings.session_ttl)
+    raise ValueError(f"Unknown session backend: {backend}")
+
+
+session_store = create_session_store(settings.session_backend)
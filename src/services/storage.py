@@ -0,0 +1,410 @@
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+from urllib.parse import quote, unquote
+
+import cloudinary
+import cloudinary.uploader
+import urllib3
+from cloudinary.utils import cloudinary_url, get_http_connector
+
+from src.conf.config import settings
+from src.services.executor import storage_executor
+from src.services.http import http_client
+from src.services.upload import sniff_image_type, SNIFF_SIZE
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: int | None = None):
+        super().__init__(size)
+        self.size = size
+
+
+@dataclass
+class StoredObject:
+    name: str
+    url: str
+    version: str | None = None
+
+
+@dataclass
+class ObjectStream:
+    """
+    An opened stored object. ``chunks`` yields the content, or the requested byte range of it,
+    and ``close`` releases the connection or file behind it.
+    """
+    chunks: AsyncIterator[bytes]
+    status_code: int = 200
+    media_type: str | None = None
+    content_length: int | None = None
+    content_range: str | None = None
+    close: Callable[[], Awaitable[None]] | None = None
+
+    async def body(self) -> AsyncIterator[bytes]:
+        """
+        The body function yields the chunks and always closes the stream afterwards,
+        also when the consumer is cancelled because the client went away.
+
+        :param self: Represent the instance of the class
+        :return: An async iterator over the content
+        :doc-author: RSA
+        """
+        try:
+            async for chunk in self.chunks:
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self.close is not None:
+            await self.close()
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    The parse_range function parses a single ``bytes=`` range of a Range header.
+    Headers it does not understand, including multiple ranges, are ignored and the whole object is served.
+
+    :param header: str | None: Value of the Range header
+    :param size: int: Size of the object in bytes
+    :return: Inclusive (start, end) byte positions or None for the whole object
+    :doc-author: RSA
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable(size)
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(size)
+    return start, min(end, size - 1)
+
+
+def probe_file(path: Path) -> tuple[os.stat_result, str | None]:
+    """
+    The probe_file function reads what a FileResponse of a local file needs: its stat and its content type.
+
+    :param path: Path: Path of the file
+    :return: The stat of the file and its image type sniffed from the first bytes
+    :doc-author: RSA
+    """
+    with open(path, 'rb') as file:
+        return os.fstat(file.fileno()), sniff_image_type(file.read(SNIFF_SIZE))
+
+
+def open_file_stream(path: Path, byte_range: str | None = None) -> ObjectStream:
+    """
+    The open_file_stream function opens a local file for streaming the whole file or a single byte range of it.
+    The file stays open until the stream is closed, so it can be unlinked meanwhile without breaking the response.
+
+    :param path: Path: Path of the file
+    :param byte_range: str | None: Value of the Range header of the client
+    :return: The opened object stream
+    :doc-author: RSA
+    """
+    file = open(path, 'rb')
+    try:
+        size = os.fstat(file.fileno()).st_size
+        span = parse_range(byte_range, size)
+        media_type = sniff_image_type(file.read(SNIFF_SIZE))
+    except Exception:
+        file.close()
+        raise
+    start, end = span if span else (0, size - 1)
+
+    async def close():
+        file.close()
+
+    return ObjectStream(chunks=_read_mapped(file, start, end + 1),
+                        status_code=206 if span else 200,
+                        media_type=media_type,
+                        content_length=end + 1 - start,
+                        content_range=f'bytes {start}-{end}/{size}' if span else None,
+                        close=close)
+
+
+async def _read_mapped(file: BinaryIO, start: int, stop: int) -> AsyncIterator[bytes]:
+    if stop <= start:
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(start, stop, CHUNK_SIZE):
+            yield mapped[offset:min(offset + CHUNK_SIZE, stop)]
+
+
+class StorageBackend(ABC):
+    """
+    Interface of the image storage. Objects are addressed by ``name``; ``url`` is what we save in the database.
+    A ``source`` to upload is either a binary file object or an URL of an already stored object.
+    ``open`` and ``close`` set up and release the connections of the backend, they are called in the app lifespan.
+    """
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def upload(self, source: BinaryIO | str, name: str) -> StoredObject:
+        ...
+
+    @abstractmethod
+    async def delete(self, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def url(self, name: str, **transformation) -> str:
+        ...
+
+    @abstractmethod
+    def name_from_url(self, url: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def open_stream(self, name: str, byte_range: str | None = None) -> ObjectStream:
+        ...
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Stores objects in Cloudinary under ``folder``.
+    The SDK is configured once, and all its API calls go through one keep-alive connection pool
+    of ``settings.cloudinary_pool_size`` connections, so concurrent uploads reuse TLS connections
+    instead of opening a new one per call.
+    """
+
+    def __init__(self, folder: str = 'PhotoShareApp'):
+        self.folder = folder
+        self._http: urllib3.PoolManager | None = None
+
+    def open(self) -> None:
+        """
+        The open function configures the Cloudinary SDK from the settings and installs the shared connection pool
+        in place of the default one of the SDK, which keeps a single connection per host.
+        The SDK has no setting for its pool, so the module global ``cloudinary.uploader._http`` is replaced;
+        the version of cloudinary is pinned in pyproject.toml for that reason.
+        It is called at startup and, as a fallback, before the first call; later calls do nothing.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: RSA
+        """
+        if self._http is not None:
+            return
+        if not hasattr(cloudinary.uploader, '_http'):
+            raise RuntimeError("cloudinary.uploader._http is missing, this version of cloudinary is not supported")
+        cloudinary.config(
+            cloud_name=settings.cloudinary_name,
+            api_key=settings.cloudinary_api_key,
+            api_secret=settings.cloudinary_api_secret,
+            secure=True
+        )
+        self._http = get_http_connector(cloudinary.config(), dict(
+            cloudinary.CERT_KWARGS,
+            maxsize=settings.cloudinary_pool_size,
+            timeout=urllib3.Timeout(connect=settings.cloudinary_connect_timeout, read=settings.cloudinary_timeout),
+        ))
+        cloudinary.uploader._http = self._http
+
+    def close(self) -> None:
+        if self._http is not None:
+            self._http.clear()
+            self._http = None
+
+    def public_id(self, name: str) -> str:
+        return f'{self.folder}/{name}'
+
+    async def upload(self, source: BinaryIO | str, name: str) -> StoredObject:
+        """
+        The upload function uploads the source to Cloudinary under the application folder.
+
+        :param self: Represent the instance of the class
+        :param source: BinaryIO | str: File object or URL to upload
+        :param name: str: Name of the object in the storage
+        :return: The stored object
+        :doc-author: RSA
+        """
+        self.open()
+        r = await storage_executor.run(cloudinary.uploader.upload, source, public_id=self.public_id(name),
+                                       overwrite=True)
+        return StoredObject(name=name, url=cloudinary.CloudinaryImage(self.public_id(name)).url,
+                            version=r.get('version'))
+
+    async def delete(self, name: str) -> None:
+        self.open()
+        await storage_executor.run(cloudinary.uploader.destroy, self.public_id(name))
+
+    def url(self, name: str, **transformation) -> str:
+        """
+        The url function builds the delivery URL of an object, optionally with a Cloudinary transformation.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the object in the storage
+        :param transformation: Cloudinary transformation options
+        :return: The URL of the object
+        :doc-author: RSA
+        """
+        self.open()
+        url, options = cloudinary_url(self.public_id(name), **transformation)
+        return url
+
+    def name_from_url(self, url: str) -> str | None:
+        return url.split('/')[-1]
+
+    async def open_stream(self, name: str, byte_range: str | None = None) -> ObjectStream:
+        """
+        The open_stream function starts a streaming GET of the object over the shared connection pool.
+        The Range header is forwarded to the CDN, which answers partial requests itself.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the object in the storage
+        :param byte_range: str | None: Value of the Range header of the client
+        :return: The opened object stream
+        :doc-author: RSA
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if byte_range:
+            headers['Range'] = byte_range
+        request = http_client.client.build_request('GET', self.url(name), headers=headers)
+        response = await http_client.client.send(request, stream=True)
+        if response.status_code == 416:
+            await response.aclose()
+            size = response.headers.get('content-range', '').rpartition('/')[2]
+            raise RangeNotSatisfiable(int(size) if size.isdigit() else None)
+        if response.status_code not in (200, 206):
+            await response.aclose()
+            raise FileNotFoundError(name)
+        content_length = response.headers.get('content-length')
+        return ObjectStream(chunks=response.aiter_raw(CHUNK_SIZE),
+                            status_code=response.status_code,
+                            media_type=response.headers.get('content-type'),
+                            content_length=int(content_length) if content_length else None,
+                            content_range=response.headers.get('content-range'),
+                            close=response.aclose)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores objects as files under ``root`` and serves them from ``base_url``.
+    Transformations are not supported: ``url`` always points to the original file.
+    """
+    name_pattern = re.compile(r'^[\w .-]+$')
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip('/')
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name: str) -> Path:
+        """
+        The path function maps an object name to a file under the storage root.
+        Names that could escape the root are rejected with FileNotFoundError.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the object in the storage
+        :return: The path of the file
+        :doc-author: RSA
+        """
+        if not self.name_pattern.match(name) or '..' in name:
+            raise FileNotFoundError(name)
+        return self.root / name
+
+    def name_from_url(self, url: str) -> str | None:
+        prefix = f'{self.base_url}/'
+        if url.startswith(prefix):
+            return unquote(url[len(prefix):])
+        return None
+
+    def _write(self, source: BinaryIO, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                shutil.copyfileobj(source, tmp, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    async def upload(self, source: BinaryIO | str, name: str) -> StoredObject:
+        """
+        The upload function writes the source to a temporary file and renames it into place,
+        so readers never see a partially written object.
+        A string source is either the URL of a local object, which is copied, or a remote URL, which is downloaded.
+
+        :param self: Represent the instance of the class
+        :param source: BinaryIO | str: File object or URL to upload
+        :param name: str: Name of the object in the storage
+        :return: The stored object
+        :doc-author: RSA
+        """
+        path = self.path(name)
+        if isinstance(source, str):
+            local_name = self.name_from_url(source)
+            if local_name is not None:
+                with open(self.path(local_name), 'rb') as src:
+                    await storage_executor.run(self._write, src, path)
+            else:
+                with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE * 16) as tmp:
+                    async with http_client.client.stream('GET', source) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            tmp.write(chunk)
+                    tmp.seek(0)
+                    await storage_executor.run(self._write, tmp, path)
+        else:
+            await storage_executor.run(self._write, source, path)
+        return StoredObject(name=name, url=self.url(name), version=str(int(path.stat().st_mtime)))
+
+    async def delete(self, name: str) -> None:
+        await storage_executor.run(self.path(name).unlink, missing_ok=True)
+
+    def url(self, name: str, **transformation) -> str:
+        return f'{self.base_url}/{quote(name)}'
+
+    async def open_stream(self, name: str, byte_range: str | None = None) -> ObjectStream:
+        """
+        The open_stream function opens a file and yields the requested bytes in chunks read through a memory map,
+        so the file is never copied into the process memory as a whole.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the object in the storage
+        :param byte_range: str | None: Value of the Range header of the client
+        :return: The opened object stream
+        :doc-author: RSA
+        """
+        return open_file_stream(self.path(name), byte_range)
+
+
+def create_storage_backend(backend: str) -> StorageBackend:
+    """
+    The create_storage_backend function creates the storage selected by the ``storage_backend`` setting.
+
+    :param backend: str: Either 'cloudinary' or 'local'
+    :return: A storage backend
+    :doc-author: RSA
+    """
+    if backend == 'cloudinary':
+        return CloudinaryStorage()
+    if backend == 'local':
+        return LocalStorage(settings.storage_local_root, settings.storage_local_url)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+storage_service = create_storage_backend(settings.storage_backend)
@@ -0,0 +1,41 @@
+from uuid import UUID
+
+from src.conf.transform import TRANSFORM_METHOD
+from src.database.db import sessionmanager
+from src.models.models import User
+from src.repository import images as repository_images
+from src.repository import transform as repository_transform
+from src.services.jobs import PermanentJobError
+from src.services.storage import storage_service
+
+TRANSFORM_JOB = 'transform'
+
+
+async def run_transform_job(payload: dict) -> dict:
+    """
+    The run_transform_job function runs a queued transformation of an image.
+    It builds the URL of the transformed image, stores the transformed copy under a new name
+    and creates the image of the user for it. The QR code is rendered on demand by ``GET /{image_id}/qr``.
+
+    :param payload: dict: The image_id, method and user_id of the job
+    :return: A dict with the image_id of the created image
+    :doc-author: RSA
+    """
+    async with sessionmanager.session() as db:
+        image = await repository_images.get_image(payload['image_id'], db)
+        user = await db.get(User, UUID(payload['user_id']))
+        if image is None or user is None:
+            raise PermanentJobError("Image not found")
+        if payload['method'] not in TRANSFORM_METHOD:
+            raise PermanentJobError("Method not found")
+        transformed_image = await repository_transform.transform_image(
+            image.path, transformation_options=TRANSFORM_METHOD[payload['method']])
+        new_name = await repository_images.format_filename()
+        stored = await storage_service.upload(transformed_image, new_name)
+        new_image = await repository_images.create_image(size=image.size,
+                                                         image_path=stored.url,
+                                                         title=f"{image.title} {payload['method']}",
+                                                         user=user,
+                                                         tag=None,
+                                                         db=db)
+        return {'image_id': new_image.id}
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import uuid
+import weakref
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from fastapi import UploadFile, HTTPException, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.conf.config import settings
+from src.services.imaging import METADATA_HEAD_SIZE
+
+# Magic bytes of the image formats we accept, checked against the first chunk of the upload
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+SNIFF_SIZE = 12
+# Room for the multipart boundaries, part headers and form fields that come with each file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Semaphores of the users with a batch upload in progress, dropped once no request holds them
+_upload_slots: weakref.WeakValueDictionary[uuid.UUID, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+
+@dataclass
+class SpooledUpload:
+    """
+    An upload that has been read once: its size, SHA-256 digest and sniffed content type are known,
+    and ``file`` is the spooled temporary file rewound to the start, ready for a single pass by the storage layer.
+    ``head`` keeps the first METADATA_HEAD_SIZE bytes for reading the image headers.
+    """
+    file: BinaryIO
+    size: int
+    digest: str
+    content_type: str
+    head: bytes = b''
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """
+    The sniff_image_type function detects the image format from the first bytes of a file.
+
+    :param head: bytes: The first bytes of the file
+    :return: The mime type of the image or None if the bytes do not belong to a supported image
+    :doc-author: RSA
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+async def spool_upload(file: UploadFile, max_size: int = settings.max_image_size) -> SpooledUpload:
+    """
+    The spool_upload function streams an uploaded file in chunks of ``settings.upload_chunk_size`` bytes.
+    While streaming it counts the bytes, feeds them to a SHA-256 hash, keeps the head of the file
+    and sniffs its magic bytes, so reading stops as soon as the file turns out not to be an image
+    or crosses ``max_size``. Besides the head only one chunk is held in memory at a time: the content itself
+    stays in the spooled temporary file that backs the UploadFile, which is rewound for the storage layer.
+    The request body has already been received by then; BodySizeLimitMiddleware rejects an oversized body
+    while it is being received.
+
+    :param file: UploadFile: The uploaded file
+    :param max_size: int: Maximum allowed size of the file in bytes
+    :return: A SpooledUpload with the size, digest and content type of the file
+    :doc-author: RSA
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    content_type = None
+    head = b''
+    await file.seek(0)
+    while chunk := await file.read(settings.upload_chunk_size):
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"File too large. Max size is {max_size} bytes")
+        if len(head) < METADATA_HEAD_SIZE:
+            head += chunk[:METADATA_HEAD_SIZE - len(head)]
+        if content_type is None and len(head) >= SNIFF_SIZE:
+            content_type = sniff_image_type(head)
+            if content_type is None:
+                break
+        hasher.update(chunk)
+    if content_type is None:
+        content_type = sniff_image_type(head)
+    if content_type is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="File is not an image. Only images are allowed")
+    await file.seek(0)
+    return SpooledUpload(file=file.file, size=size, digest=hasher.hexdigest(), content_type=content_type,
+                         head=head)
+
+
+def upload_slots(user_id: uuid.UUID) -> asyncio.Semaphore:
+    """
+    The upload_slots function returns the semaphore that caps how many files of one user are processed at once.
+    All batch requests of the user share it, so parallel batches cannot multiply the cap.
+
+    :param user_id: uuid.UUID: Id of the uploading user
+    :return: The semaphore of the user
+    :doc-author: RSA
+    """
+    slots = _upload_slots.get(user_id)
+    if slots is None:
+        slots = asyncio.Semaphore(settings.batch_upload_parallelism)
+        _upload_slots[user_id] = slots
+    return slots
+
+
+def upload_body_limit(files: int) -> int:
+    return files * (settings.max_image_size + MULTIPART_OVERHEAD)
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware that caps the request body of the upload routes, so an oversized upload is rejected
+    with 413 before it is received and spooled to disk as a whole. A request whose Content-Length exceeds
+    the limit of its route is answered without reading the body; a chunked body is counted as it arrives
+    and the request fails as soon as it crosses the limit.
+    """
+
+    def __init__(self, app: ASGIApp, limits: dict[tuple[str, str], int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self.limits.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request too large. Max size is {limit} bytes"
+        content_length = Headers(scope=scope).get('content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
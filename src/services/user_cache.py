@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.conf.config import settings
+from src.database.db import redis_client
+from src.models.models import User
+from src.utils.lru import LRUCache
+
+# The columns of the authenticated user read by the routes, the role checks and GET /users/me.
+# The password is not kept in memory.
+USER_CACHE_FIELDS = ('id', 'first_name', 'last_name', 'email', 'role', 'avatar', 'created_at', 'updated_at',
+                     'confirmed', 'is_active')
+
+
+class UserCache:
+    """
+    A per-worker cache of the authenticated users, keyed by the subject and issue time of the access token,
+    so an authenticated request usually resolves its user without a query.
+    Entries expire after ``settings.user_cache_ttl`` seconds and are dropped explicitly when the status, role,
+    password or profile of the user changes. Every invalidation moves the user to a new
+    generation and entries of an older generation are ignored, so a user loaded before a change and cached
+    after it is never served. The generations are kept for the ``max_size`` users invalidated last; users without
+    one are at the floor generation, which is raised past every generation handed out whenever one is evicted,
+    so an evicted generation never makes older entries valid again. With ``settings.user_cache_pubsub`` the invalidations are also published on
+    a Redis channel, so they reach the other workers.
+    """
+    channel = 'users:invalidate'
+
+    def __init__(self, max_size: int, ttl: float):
+        self.ttl = ttl
+        self.entries = LRUCache(max_size)
+        self.generations = LRUCache(max_size)
+        self.floor = 0
+        self.counter = 0
+
+    def generation(self, email: str) -> int:
+        return self.generations.get(email, self.floor)
+
+    async def get(self, email: str, issued_at, db: AsyncSession) -> User | None:
+        """
+        The get function returns the cached user for an access token, attached to the session of the request.
+        The user is merged without loading it, so only the cached columns are set; a route that needs
+        the password of the user loads the user itself.
+
+        :param self: Represent the instance of the class
+        :param email: str: The subject of the token
+        :param issued_at: The iat claim of the token
+        :param db: AsyncSession: The session of the request
+        :return: The user or None if it is not cached
+        :doc-author: RSA
+        """
+        entry = self.entries.get((email, issued_at))
+        if entry is None or entry[1] <= time.monotonic() or entry[2] != self.generation(email):
+            return None
+        return await db.merge(entry[0], load=False)
+
+    def put(self, email: str, issued_at, user: User, generation: int):
+        """
+        The put function caches the user loaded for an access token.
+
+        :param self: Represent the instance of the class
+        :param email: str: The subject of the token
+        :param issued_at: The iat claim of the token
+        :param user: User: The user loaded from the database
+        :param generation: int: The generation of the user read before it was loaded
+        :return: None
+        :doc-author: RSA
+        """
+        if generation != self.generation(email):
+            return
+        snapshot = User(**{field: getattr(user, field) for field in USER_CACHE_FIELDS})
+        make_transient_to_detached(snapshot)
+        self.entries.put((email, issued_at), (snapshot, time.monotonic() + self.ttl, generation))
+
+    def drop(self, email: str):
+        if self.generations.get(email) is None and len(self.generations) >= self.generations.max_size:
+            self.floor = self.counter
+        self.counter += 1
+        self.generations.put(email, self.counter)
+
+    async def invalidate(self, email: str):
+        """
+        The invalidate function drops the cached entries of a user on this worker and, when enabled,
+        announces it to the other workers.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the changed user
+        :return: None
+        :doc-author: RSA
+        """
+        self.drop(email)
+        if settings.user_cache_pubsub:
+            try:
+                await redis_client.publish(self.channel, email)
+            except Exception as err:
+                print(err)
+
+    async def listen(self):
+        """
+        The listen function drops the entries of the users invalidated by the other workers, forever.
+        After a lost connection every entry is dropped, as invalidations may have been missed.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: RSA
+        """
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.drop(message['data'])
+            except Exception as err:
+                print(err)
+            self.entries.clear()
+            await asyncio.sleep(settings.user_cache_retry_delay)
+
+
+user_cache = UserCache(settings.user_cache_size, settings.user_cache_ttl)
@@ -0,0 +1,48 @@
+import hashlib
+from typing import Iterable
+
+from fastapi import Request, Response, status
+
+# JSON read endpoints may be stored by clients and CDNs but are revalidated with If-None-Match on every use
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Stored files are never rewritten under the same name, so they can be cached for good
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def weak_etag(versions: Iterable) -> str:
+    """
+    The weak_etag function builds a weak ETag from the version data of the rows of a response,
+    e.g. their id and update time, so it changes whenever one of the rows does.
+
+    :param versions: Iterable: A hashable version tuple per row
+    :return: The ETag header value
+    :doc-author: RSA
+    """
+    digest = hashlib.blake2b(repr(tuple(versions)).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    The etag_matches function checks the If-None-Match header of a request against an ETag
+    with the weak comparison used for GET requests.
+
+    :param request: Request: The request
+    :param etag: str: The current ETag of the resource
+    :return: True when the client already has the current version
+    :doc-author: RSA
+    """
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag.removeprefix('W/') in {tag.strip().removeprefix('W/') for tag in header.split(',')}
+
+
+def validators(etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> dict[str, str]:
+    return {'ETag': etag, 'Cache-Control': cache_control}
+
+
+def not_modified(headers: dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
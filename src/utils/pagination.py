@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    The encode_cursor function builds the opaque cursor that points right after the given row.
+
+    :param created_at: datetime: Creation time of the last row of a page
+    :param row_id: int: Id of the last row of a page
+    :return: A URL safe cursor token
+    :doc-author: RSA
+    """
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int] | None:
+    """
+    The decode_cursor function reads a cursor built by encode_cursor.
+
+    :param cursor: str | None: The cursor token of the request
+    :return: The (created_at, id) key of the last row of the previous page or None without a cursor
+    :doc-author: RSA
+    """
+    if not cursor:
+        return None
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def paginate(query: Select, model, limit: int, offset: int = 0, after: tuple[datetime, int] | None = None,
+             descending: bool = True) -> Select:
+    """
+    The paginate function orders a query by (created_at, id) and selects one page of it.
+    With a cursor the page starts right after the cursor row, which the composite (created_at, id) indexes
+    find with an index seek whatever the depth of the page; the offset is only used without a cursor.
+
+    :param query: Select: The query to paginate
+    :param model: The model with the created_at and id columns
+    :param limit: int: Size of the page
+    :param offset: int: Number of rows to skip, without a cursor
+    :param after: tuple[datetime, int] | None: Key of the last row of the previous page
+    :param descending: bool: Newest rows first
+    :return: The query of the page
+    :doc-author: RSA
+    """
+    key = tuple_(model.created_at, model.id)
+    if descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at, model.id)
+    if after is not None:
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    elif offset:
+        query = query.offset(offset)
+    return query.limit(limit)
+
+
+def next_cursor_headers(rows: list, limit: int) -> dict[str, str]:
+    """
+    The next_cursor_headers function builds the X-Next-Cursor header of a page, which is only set
+    when the page is full, so list responses keep their shape.
+
+    :param rows: list: Rows of the page
+    :param limit: int: Size of the page
+    :return: The headers to add to the response
+    :doc-author: RSA
+    """
+    if rows and len(rows) >= limit:
+        return {NEXT_CURSOR_HEADER: encode_cursor(rows[-1].created_at, rows[-1].id)}
+    return {}
+
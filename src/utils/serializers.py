@@ -0,0 +1,61 @@
+import orjson
+
+from src.models.models import Comment, Image, User
+
+
+def user_row(user: User) -> dict:
+    return {
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+    }
+
+
+def image_row(image: Image) -> dict:
+    """
+    The image_row function builds the ImageReadSchema output of an image straight from the loaded row.
+    The rows come from the database, so they are not validated again before being serialized.
+
+    :param image: Image: The image with its owner, tags and blob loaded
+    :return: A dict with the fields of ImageReadSchema
+    :doc-author: RSA
+    """
+    return {
+        'id': image.id,
+        'path': image.path,
+        'size': image.size,
+        'title': image.title,
+        'created_at': image.created_at,
+        'count_tags': image.count_tags,
+        'tags': [{'name': tag.name} for tag in image.tags],
+        'owner': user_row(image.owner),
+        'variants': image.variants,
+        'width': image.width,
+        'height': image.height,
+        'format': image.format,
+        'orientation': image.orientation,
+        'taken_at': image.taken_at,
+    }
+
+
+def comment_row(comment: Comment) -> dict:
+    return {
+        'id': comment.id,
+        'text': comment.text,
+        'created_at': comment.created_at,
+        'updated_at': comment.updated_at,
+        'image_id': comment.image_id,
+    }
+
+
+def dump_json(content) -> bytes:
+    """
+    The dump_json function serializes rows built by the functions above with orjson,
+    which writes datetimes and UUIDs the same way as the pydantic schemas.
+
+    :param content: The dicts or lists to serialize
+    :return: The JSON document
+    :doc-author: RSA
+    """
+    return orjson.dumps(content)
@@ -0,0 +1,123 @@
+"""
+Bounds on the statements and rows of the image queries. The relationships of the models are lazy and every
+query states what it loads, see src.repository.images.IMAGE_LOAD; an eager load coming back shows up here
+as extra statements or as rows multiplied by the images of a tag or the tags of an image.
+
+The queries run on an in-memory SQLite database, which needs aiosqlite. The settings are read from the
+environment as for the application.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.models.models import Base, Image, ImageBlob, Tag, User
+from src.repository import images as repository_images
+from src.services.cache import ResponseCache, MemoryCache
+
+IMAGES = 30
+TAGS_PER_IMAGE = 3
+UNTAGGED_ID = 1
+
+
+class QueryCounter:
+    """
+    Counts the statements sent to the database and the rows the ORM queries return,
+    before the rows are turned into objects, so rows repeated by a join are counted.
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def do_orm_execute(self, orm_execute_state):
+        if not orm_execute_state.is_select:
+            return None
+        frozen = orm_execute_state.invoke_statement().freeze()
+        self.rows += len(frozen.data)
+        return frozen()
+
+
+async def seed(session_maker):
+    async with session_maker() as db:
+        user = User(email="owner@example.com", password="secret", first_name="Owner", last_name="Example")
+        common = Tag(name="common")
+        db.add_all([user, common])
+        db.add(Image(title="untagged", size=100, path="images/untagged.jpg", owner=user))
+        await db.flush()
+        for number in range(IMAGES):
+            digest = f"{number:064x}"
+            db.add(ImageBlob(digest=digest, name=f"{number}.jpg", path=f"images/{number}.jpg", size=100))
+            tags = [common] + [Tag(name=f"tag-{number}-{index}") for index in range(TAGS_PER_IMAGE - 1)]
+            db.add(Image(title=f"image {number}", size=100, path=f"images/{number}.jpg", digest=digest,
+                         owner=user, tags=tags, count_tags=len(tags)))
+        await db.commit()
+
+
+def count_queries(body):
+    """
+    The count_queries function runs body with a session of a seeded database and counts its queries.
+
+    :param body: Coroutine function called with the session
+    :return: The result of body and the QueryCounter
+    :doc-author: RSA
+    """
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await seed(session_maker)
+        counter = QueryCounter()
+        try:
+            async with session_maker() as db:
+                event.listen(engine.sync_engine, "after_cursor_execute", counter.after_cursor_execute)
+                event.listen(db.sync_session, "do_orm_execute", counter.do_orm_execute)
+                result = await body(db)
+        finally:
+            await engine.dispose()
+        return result, counter
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(repository_images, "response_cache", ResponseCache(MemoryCache()))
+
+
+def test_get_tag_does_not_load_images():
+    tag, counter = count_queries(lambda db: repository_images.get_tag("common", db))
+
+    assert tag.name == "common"
+    assert "images" not in tag.__dict__
+    assert counter.statements == 1
+    assert counter.rows == 1
+
+
+def test_get_images_loads_tags_in_one_query():
+    limit = 10
+    images, counter = count_queries(lambda db: repository_images.get_images(limit, 0, db))
+
+    assert len(images) == limit
+    assert all(len(image.tags) == TAGS_PER_IMAGE for image in images)
+    # the page joined with owner and blob, then the tags of the page by one SELECT ... IN
+    assert counter.statements == 2
+    assert counter.rows == limit + limit * TAGS_PER_IMAGE
+
+
+@pytest.mark.parametrize("tag_name, statements", [("common", 7), ("new", 9)])
+def test_add_tag_to_image_does_not_load_tagged_images(tag_name, statements):
+    image, counter = count_queries(lambda db: repository_images.add_tag_to_image(UNTAGGED_ID, tag_name, db))
+
+    assert [tag.name for tag in image.tags] == [tag_name]
+    assert image.owner.email == "owner@example.com"
+    # the image with its tags, the tag, the insert into image_to_tag and the update of count_tags,
+    # then the image reloaded with its tags; a new tag adds its insert and refresh.
+    # The rows do not depend on the IMAGES images that already have the tag "common"
+    assert counter.statements == statements
+    assert counter.rows == 4
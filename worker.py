@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import multiprocessing
+
+from src.services.http import http_client
+from src.services.jobs import job_queue, run_worker
+from src.services.storage import storage_service
+from src.services.transform import TRANSFORM_JOB, run_transform_job
+
+JOB_HANDLERS = {
+    TRANSFORM_JOB: run_transform_job,
+}
+
+
+def start_workers(count: int) -> list[asyncio.Task]:
+    """
+    The start_workers function starts ``count`` job workers as tasks of the running event loop.
+
+    :param count: int: Number of concurrent workers
+    :return: The worker tasks
+    :doc-author: RSA
+    """
+    return [asyncio.create_task(run_worker(job_queue, JOB_HANDLERS)) for _ in range(count)]
+
+
+async def serve(concurrency: int):
+    storage_service.open()
+    try:
+        await asyncio.gather(*start_workers(concurrency))
+    finally:
+        storage_service.close()
+        await http_client.close()
+
+
+def main(concurrency: int):
+    try:
+        asyncio.run(serve(concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the PhotoShare background job workers")
+    parser.add_argument('-p', '--processes', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help="Number of concurrent jobs per process")
+    args = parser.parse_args()
+    processes = [multiprocessing.Process(target=main, args=(args.concurrency,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()